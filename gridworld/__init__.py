@@ -1 +1,3 @@
-from .env import GridWorld
\ No newline at end of file
+from .env import GridWorld
+from .batched import BatchedGridWorld
+from .vector import VectorGridWorld, SubprocVectorGridWorld, EnvPool
@@ -0,0 +1,245 @@
+import warnings
+
+import numpy as np
+from gym.spaces import Dict, Box, Discrete
+from gym.vector import VectorEnv
+
+from gridworld.core.world import Agent, ArrayWorld
+from gridworld.core import kernels
+from gridworld.env import String
+from gridworld.tasks.task import Task, Tasks
+from gridworld.utils import BLUE
+
+
+class BatchedGridWorld(VectorEnv):
+    """
+    Simulates `num_envs` independent vector-state gridworlds in one process.
+
+    The state of all agents (position, rotation, vertical speed, inventory,
+    active block) and all voxel grids are kept in stacked numpy arrays and
+    each `.step` advances the whole batch with a single compiled kernel.
+    The semantics are those of `GridWorld` with the discrete walking action
+    space (`discretize=True`), no rendering and `vector_state=True`.
+
+    Finished environments are reset automatically: the observation
+    returned for them belongs to the new episode and the last observation
+    of the finished one is stored in ``infos[i]['terminal_observation']``.
+    """
+    def __init__(
+            self, num_envs, max_steps=250, select_and_place=False,
+            right_placement_scale=1., wrong_placement_scale=0.1,
+            target_in_obs=False) -> None:
+        self.max_steps = max_steps
+        self.select_and_place = select_and_place
+        self.right_placement_scale = right_placement_scale
+        self.wrong_placement_scale = wrong_placement_scale
+        self.target_in_obs = target_in_obs
+        observation_space = {
+            'inventory': Box(low=0, high=20, shape=(6,), dtype=np.float32),
+            'compass': Box(low=-180, high=180, shape=(1,), dtype=np.float32),
+            'dialog': String(),
+            'agentPos': Box(
+                low=np.array([-8, -2, -8, -90, 0], dtype=np.float32),
+                high=np.array([8, 12, 8, 90, 360], dtype=np.float32),
+                shape=(5,)
+            ),
+            'grid': Box(low=-1, high=7, shape=(9, 11, 11), dtype=np.int32)
+        }
+        if target_in_obs:
+            observation_space['target_grid'] = Box(low=-1, high=7, shape=(9, 11, 11), dtype=np.int32)
+        super().__init__(num_envs, Dict(observation_space), Discrete(18))
+
+        world = ArrayWorld()
+        world._initialize()
+        self.voxels = np.repeat(world.voxels[None], num_envs, axis=0)
+        oy, ox, oz = ArrayWorld.OFFSET
+        # build zone views of the voxel grids
+        self.grid = self.voxels[:, oy - 1:oy + 8, ox - 5:ox + 6, oz - 5:oz + 6]
+        self.position = np.zeros((num_envs, 3), dtype=np.float64)
+        self.rotation = np.zeros((num_envs, 2), dtype=np.float64)
+        self.dy = np.zeros(num_envs, dtype=np.float64)
+        self.time_int_steps = np.full(num_envs, 2, dtype=np.int64)
+        self.inventory = np.full((num_envs, 6), 20, dtype=np.int64)
+        self.active_block = np.full(num_envs, BLUE, dtype=np.int64)
+        self.step_no = np.zeros(num_envs, dtype=np.int64)
+        self._changes = np.zeros((num_envs, 5), dtype=np.int64)
+
+        self._task = None
+        self._task_generator = None
+        self.tasks = [None] * num_envs
+        self._synthetic_tasks = [None] * num_envs
+        self._synthetic_init_grids = np.zeros((num_envs, 9, 11, 11), dtype=np.int64)
+        # grids of the synthetic tasks (grid - init grid), updated at the changed voxels
+        self._synthetic_grids = np.zeros((num_envs, 9, 11, 11), dtype=np.int64)
+        self._target_grids = np.zeros((num_envs, 9, 11, 11), dtype=np.int32)
+        self._max_int = np.zeros(num_envs, dtype=np.int64)
+        self._target_size = np.zeros(num_envs, dtype=np.int64)
+
+    def set_task(self, task: Task):
+        """
+        Assigns provided task to all environments of the batch. See `GridWorld.set_task`.
+        """
+        if self._task_generator is not None:
+            warnings.warn("The .set_task method has no effect with an initialized tasks generator. "
+                          "Drop it using .set_tasks_generator(None) after calling .set_task")
+        self._task = task
+        self.reset()
+
+    def set_task_generator(self, task_generator: Tasks):
+        """
+        Sets task generator for the batch. Each environment queries the .reset
+        method of the generator on its own reset. See `GridWorld.set_task_generator`.
+        """
+        self._task_generator = task_generator
+        self.reset()
+
+    def _reset_env(self, i):
+        if self._task_generator is not None:
+            task = self._task_generator.reset()
+        elif self._task is not None:
+            task = self._task
+        else:
+            raise ValueError('Task is not initialized! Initialize task before working with'
+                             ' the environment using .set_task method OR set tasks distribution using '
+                             '.set_task_generator method')
+        # task sets return their currently active task
+        task = task.reset()
+        self.tasks[i] = task
+        init_grid = np.zeros((9, 11, 11), dtype=np.int64)
+        if task.starting_grid is not None:
+            init_grid = Tasks.to_dense(task.starting_grid)
+        self.grid[i] = init_grid
+        self._synthetic_init_grids[i] = init_grid
+        # create a synthetic task with only diff blocks.
+        # blocks to remove have negative ids.
+        synthetic_task = Task('', target_grid=task.target_grid - init_grid)
+        synthetic_task.reset()
+        self._synthetic_tasks[i] = synthetic_task
+        self._max_int[i] = synthetic_task.max_int
+        self._target_size[i] = synthetic_task.target_size
+        self._target_grids[i] = task.target_grid
+        self.inventory[i] = 20
+        for color in range(1, 7):
+            self.inventory[i, color - 1] -= (init_grid == color).sum()
+        self._synthetic_grids[i] = 0
+        # as in GridWorld.reset, the vertical speed, the time integration
+        # steps and the active block carry over to the next episode
+        self.position[i] = 0.
+        self.rotation[i] = 0.
+        self.step_no[i] = 0
+
+    def _get_obs(self, env_ids=None, keys=None):
+        if env_ids is None:
+            tasks = self.tasks
+            env_ids = slice(None)
+        else:
+            tasks = [self.tasks[i] for i in env_ids]
+        if keys is None:
+            keys = self.single_observation_space.spaces
+        yaw, pitch = self.rotation[env_ids, 0], self.rotation[env_ids, 1]
+        obs = {}
+        if 'inventory' in keys:
+            obs['inventory'] = self.inventory[env_ids].astype(np.float32)
+        if 'compass' in keys:
+            obs['compass'] = (yaw[:, None] - 180.).astype(np.float32)
+        if 'dialog' in keys:
+            obs['dialog'] = [task.chat for task in tasks]
+        if 'agentPos' in keys:
+            obs['agentPos'] = np.concatenate([
+                self.position[env_ids], pitch[:, None], yaw[:, None]
+            ], axis=1).astype(np.float32)
+        if 'grid' in keys:
+            obs['grid'] = self.grid[env_ids].astype(np.int32)
+        if 'target_grid' in keys and self.target_in_obs:
+            obs['target_grid'] = self._target_grids[env_ids].copy()
+        return obs
+
+    def reset(self, env_ids=None, **kwargs):
+        """
+        Resets environments with given ids (all by default) and returns
+        the batch of observations of all environments.
+        """
+        if env_ids is None:
+            env_ids = range(self.num_envs)
+        for i in env_ids:
+            self._reset_env(i)
+        return self._get_obs()
+
+    def step_async(self, actions):
+        self._actions = np.asarray(actions, dtype=np.int64)
+
+    def step_wait(self, **kwargs):
+        rewards, dones, infos = self._step_batch(self._actions)
+        return self._get_obs(), rewards, dones, infos
+
+    def step_many(self, actions, obs_keys=None):
+        """
+        Runs T steps of the batch, equivalent to calling `.step` with each
+        row of `actions` of shape (T, num_envs) but only the observations of
+        `obs_keys` (all by default) are computed and stacked.
+
+        Returns:
+            obs (dict): observations of shape (T, num_envs, ...), dialogs as T lists;
+            rewards, dones (np.ndarray): arrays of shape (T, num_envs);
+            infos (list): T lists of infos of each environment.
+        """
+        spaces = self.single_observation_space.spaces
+        keys = list(spaces) if obs_keys is None else [key for key in spaces if key in obs_keys]
+        unknown = set(obs_keys or ()) - set(spaces)
+        if unknown:
+            raise ValueError(f'Unknown observation keys: {sorted(unknown)}, available: {list(spaces)}')
+        actions = np.asarray(actions, dtype=np.int64)
+        rewards = np.zeros(actions.shape, dtype=np.float64)
+        dones = np.zeros(actions.shape, dtype=bool)
+        obs = {
+            key: [] if key == 'dialog' else np.zeros((len(actions), self.num_envs, *spaces[key].shape),
+                                                     dtype=spaces[key].dtype)
+            for key in keys
+        }
+        infos = []
+        for t, step_actions in enumerate(actions):
+            rewards[t], dones[t], step_infos = self._step_batch(step_actions)
+            infos.append(step_infos)
+            for key, value in self._get_obs(keys=keys).items():
+                if key == 'dialog':
+                    obs[key].append(value)
+                else:
+                    obs[key][t] = value
+        return obs, rewards, dones, infos
+
+    def _step_batch(self, actions):
+        """
+        Advances all environments by one step and resets the finished ones.
+        """
+        actions = np.ascontiguousarray(actions, dtype=np.int64)
+        if None in self.tasks:
+            raise ValueError('Task is not initialized! Run .reset() first.')
+        self.step_no += 1
+        kernels.step_batch(
+            self.voxels, *ArrayWorld.OFFSET, self.position, self.rotation,
+            self.dy, self.time_int_steps, self.inventory, self.active_block,
+            actions, self.select_and_place, 1 / 20., Agent.PAD, self._changes
+        )
+        rewards = np.zeros(self.num_envs, dtype=np.float64)
+        # the reward can only change for environments where a block was placed or removed
+        for i in np.flatnonzero(self._changes[:, 0] >= 0):
+            synthetic_task = self._synthetic_tasks[i]
+            y, x, z, old, new = self._changes[i].tolist()
+            init = self._synthetic_init_grids[i, y, x, z]
+            self._synthetic_grids[i, y, x, z] = new - init
+            right_placement, wrong_placement, _ = synthetic_task.step_intersection(
+                self._synthetic_grids[i], [((y, x, z), old - init, new - init)])
+            if right_placement == 0:
+                rewards[i] = wrong_placement * self.wrong_placement_scale
+            else:
+                rewards[i] = right_placement * self.right_placement_scale
+            self._max_int[i] = synthetic_task.max_int
+        dones = (self._max_int == self._target_size) | (self.step_no == self.max_steps)
+        infos = [{} for _ in range(self.num_envs)]
+        done_ids = np.flatnonzero(dones)
+        if len(done_ids) > 0:
+            terminal_obs = self._get_obs(done_ids)
+            for j, i in enumerate(done_ids):
+                infos[i]['terminal_observation'] = {k: v[j] for k, v in terminal_obs.items()}
+                self._reset_env(i)
+        return rewards, dones, infos
@@ -1 +1 @@
-from .world import World, Agent
\ No newline at end of file
+from .world import World, ArrayWorld, Agent
\ No newline at end of file
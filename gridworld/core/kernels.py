@@ -0,0 +1,303 @@
+""" Compiled kernels that operate on the voxel array of `ArrayWorld`.
+
+The voxel array is indexed as ``[y, x, z]`` and ``(oy, ox, oz)`` is the
+array index of the world origin. Cells outside of the array are empty.
+"""
+import math
+
+import numba
+import numpy as np
+
+from ..utils import FLYING_SPEED, WALKING_SPEED, GRAVITY, TERMINAL_VELOCITY, PLAYER_HEIGHT, JUMP_SPEED
+
+
+@numba.njit(cache=True)
+def _solid(voxels, oy, ox, oz, x, y, z):
+    y, x, z = y + oy, x + ox, z + oz
+    return 0 <= y < voxels.shape[0] and 0 <= x < voxels.shape[1] \
+        and 0 <= z < voxels.shape[2] and voxels[y, x, z] != 0
+
+
+@numba.njit(cache=True)
+def traverse(voxels, oy, ox, oz, px, py, pz, dx, dy, dz, max_distance):
+    """ Amanatides-Woo traversal of the ray ``p + t * d, 0 <= t <= max_distance``.
+
+    Visits every cell the ray crosses exactly once, in order, and stops at
+    the first non-empty one.
+
+    Returns
+    -------
+    result : tuple
+        ``(hit, has_previous, bx, by, bz, qx, qy, qz)`` where ``b`` is the
+        hit block and ``q`` is the cell visited right before it (it shares
+        a face with ``b``). `has_previous` is False if the ray starts inside
+        a block.
+    """
+    x, y, z = int(np.rint(px)), int(np.rint(py)), int(np.rint(pz))
+    if _solid(voxels, oy, ox, oz, x, y, z):
+        return True, False, x, y, z, 0, 0, 0
+    inf = np.inf
+    step_x = 1 if dx > 0 else (-1 if dx < 0 else 0)
+    step_y = 1 if dy > 0 else (-1 if dy < 0 else 0)
+    step_z = 1 if dz > 0 else (-1 if dz < 0 else 0)
+    # distance along the ray to the first cell boundary and between boundaries
+    t_x = (x + 0.5 * step_x - px) / dx if step_x != 0 else inf
+    t_y = (y + 0.5 * step_y - py) / dy if step_y != 0 else inf
+    t_z = (z + 0.5 * step_z - pz) / dz if step_z != 0 else inf
+    dt_x = step_x / dx if step_x != 0 else inf
+    dt_y = step_y / dy if step_y != 0 else inf
+    dt_z = step_z / dz if step_z != 0 else inf
+    while True:
+        qx, qy, qz = x, y, z
+        if t_x <= t_y and t_x <= t_z:
+            if t_x > max_distance:
+                break
+            x += step_x
+            t_x += dt_x
+        elif t_y <= t_z:
+            if t_y > max_distance:
+                break
+            y += step_y
+            t_y += dt_y
+        else:
+            if t_z > max_distance:
+                break
+            z += step_z
+            t_z += dt_z
+        if _solid(voxels, oy, ox, oz, x, y, z):
+            return True, True, x, y, z, qx, qy, qz
+    return False, False, 0, 0, 0, 0, 0, 0
+
+
+@numba.njit(cache=True)
+def traverse_batch(voxels, oy, ox, oz, positions, vectors, max_distance):
+    """ Runs `traverse` for each row of `positions` and `vectors`.
+
+    Returns
+    -------
+    blocks, previous : np.ndarray of shape (N, 3)
+    hit, has_previous : np.ndarray of shape (N,)
+    """
+    n = positions.shape[0]
+    blocks = np.zeros((n, 3), dtype=np.int64)
+    previous = np.zeros((n, 3), dtype=np.int64)
+    hit = np.zeros(n, dtype=np.bool_)
+    has_previous = np.zeros(n, dtype=np.bool_)
+    for i in range(n):
+        h, hp, bx, by, bz, qx, qy, qz = traverse(
+            voxels, oy, ox, oz,
+            positions[i, 0], positions[i, 1], positions[i, 2],
+            vectors[i, 0], vectors[i, 1], vectors[i, 2], max_distance
+        )
+        hit[i] = h
+        has_previous[i] = hp
+        blocks[i, 0], blocks[i, 1], blocks[i, 2] = bx, by, bz
+        previous[i, 0], previous[i, 1], previous[i, 2] = qx, qy, qz
+    return blocks, previous, hit, has_previous
+
+
+@numba.njit(cache=True)
+def collide(voxels, oy, ox, oz, x, y, z, height, pad, agent_dy):
+    """ Compiled counterpart of `World.collide`.
+
+    Returns
+    -------
+    result : tuple
+        The new ``(x, y, z)`` position of the player and its vertical speed.
+    """
+    p = np.array((x, y, z))
+    cell = np.empty(3, dtype=np.int64)
+    for i in range(3):
+        cell[i] = int(np.rint(p[i]))
+    op = np.empty(3, dtype=np.int64)
+    # the same order as in utils.FACES, each face has a single non-zero axis
+    for i, side in ((1, 1), (1, -1), (0, -1), (0, 1), (2, 1), (2, -1)):
+        # How much overlap you have with this dimension.
+        d = (p[i] - cell[i]) * side
+        if d < pad:
+            continue
+        for dy in range(height):  # check each height
+            op[:] = cell
+            op[1] -= dy
+            op[i] += side
+            if not _solid(voxels, oy, ox, oz, op[0], op[1], op[2]):
+                continue
+            p[i] -= (d - pad) * side
+            if i == 1:
+                # You are colliding with the ground or ceiling, so stop
+                # falling / rising.
+                agent_dy = 0.
+            break
+    return p[0], p[1], p[2], agent_dy
+
+
+@numba.njit(cache=True)
+def update(voxels, oy, ox, oz, x, y, z, yaw, pitch, strafe_x, strafe_z,
+           flying, agent_dy, time_int_steps, dt, pad):
+    """ Compiled counterpart of `World.update`: runs `time_int_steps` motion,
+    gravity and collision substeps of `World._update` at once.
+
+    Returns
+    -------
+    result : tuple
+        The new ``(x, y, z)`` position of the agent, its vertical speed and
+        the number of integration steps for the next update.
+    """
+    m = time_int_steps
+    dt = min(dt, 0.2) / m
+    speed = FLYING_SPEED if flying else WALKING_SPEED
+    d = dt * speed  # distance covered this tick.
+    # the motion vector only depends on the agent state which is fixed during the update
+    dx, dy, dz = 0., 0., 0.
+    if strafe_x != 0 or strafe_z != 0:
+        strafe = math.degrees(math.atan2(strafe_x, strafe_z))
+        y_angle = math.radians(pitch)
+        x_angle = math.radians(yaw + strafe)
+        if flying:
+            mul = math.cos(y_angle)
+            dy = math.sin(y_angle)
+            if strafe_z != 0:
+                # Moving left or right.
+                dy = 0.
+                mul = 1.
+            if strafe_x > 0:
+                # Moving backwards.
+                dy *= -1
+            # When you are flying up or down, you have less left and right
+            # motion.
+            dx = math.cos(x_angle) * mul
+            dz = math.sin(x_angle) * mul
+        else:
+            dx = math.cos(x_angle)
+            dz = math.sin(x_angle)
+    dx, dy, dz = dx * d, dy * d, dz * d
+    for _ in range(m):
+        if not flying:
+            agent_dy -= dt * GRAVITY
+            if agent_dy < -14:
+                time_int_steps = 12
+            elif agent_dy < -10:
+                time_int_steps = 8
+            elif agent_dy < -5:
+                time_int_steps = 4
+            else:
+                time_int_steps = 2
+            agent_dy = max(agent_dy, -TERMINAL_VELOCITY)
+        ddy = dy + agent_dy * dt
+        cx, cy, cz = x + dx, y + ddy, z + dz
+        # the same check as World.build_zone(*cand, pad=2)
+        if -7 <= cx <= 7 and -7 <= cz <= 7 and -3 <= cy < 10:
+            x, y, z, agent_dy = collide(
+                voxels, oy, ox, oz, cx, cy, cz, PLAYER_HEIGHT, pad, agent_dy)
+        elif not flying:
+            x, y, z, agent_dy = collide(
+                voxels, oy, ox, oz, x, y + ddy, z, PLAYER_HEIGHT, pad, agent_dy)
+    return x, y, z, agent_dy, time_int_steps
+
+
+@numba.njit(cache=True)
+def step_batch(voxels, oy, ox, oz, position, rotation, agent_dy, time_int_steps,
+               inventory, active_block, actions, select_and_place, dt, pad, changes):
+    """ Applies one discrete walking action to each of N walking agents.
+
+    This follows `World.step` with ``action_space='walking'`` and
+    ``discretize=True``: `parse_walking_discrete_action`, `movement`,
+    `move_camera`, `place_or_remove_block` and `update`. Agents live in
+    separate worlds, ``voxels[i]`` being the world of the i-th agent.
+    All state arrays are updated in place.
+
+    Parameters
+    ----------
+    voxels : np.ndarray of shape (N, Y, X, Z)
+    position : np.ndarray of shape (N, 3)
+    rotation : np.ndarray of shape (N, 2)
+        (yaw, pitch) of each agent.
+    agent_dy, time_int_steps, active_block : np.ndarray of shape (N,)
+    inventory : np.ndarray of shape (N, 6)
+    actions : np.ndarray of shape (N,)
+    changes : np.ndarray of shape (N, 5)
+        Output. ``(y, x, z, old, new)`` build zone grid index and block ids
+        of the block changed by each agent, ``y`` is -1 if nothing changed.
+    """
+    for i in range(actions.shape[0]):
+        changes[i, 0] = -1
+        action = actions[i]
+        # parse_walking_discrete_action
+        strafe_x, strafe_z = 0., 0.
+        jump = 0.
+        hotbar = 0
+        camera_x, camera_y = 0., 0.
+        remove, add = False, False
+        if action == 1:
+            strafe_x = -1.
+        elif action == 2:
+            strafe_x = 1.
+        elif action == 3:
+            strafe_z = -1.
+        elif action == 4:
+            strafe_z = 1.
+        elif action == 5:
+            jump = 1.
+        elif 6 <= action <= 11:
+            hotbar = action - 5
+        elif action == 12:
+            camera_x = -5.
+        elif action == 13:
+            camera_x = 5.
+        elif action == 14:
+            camera_y = -5.
+        elif action == 15:
+            camera_y = 5.
+        elif action == 16:
+            remove = True
+        elif action == 17:
+            add = True
+        if select_and_place and hotbar != 0:
+            add = True
+            remove = False
+        # movement
+        if jump != 0 and agent_dy[i] == 0:
+            agent_dy[i] = JUMP_SPEED * jump
+        if hotbar != 0:
+            active_block[i] = hotbar
+        # move_camera
+        yaw = rotation[i, 0] + camera_x
+        pitch = max(-90., min(90., rotation[i, 1] + camera_y))
+        # place_or_remove_block
+        if add != remove:
+            m = math.cos(math.radians(pitch))
+            hit, has_previous, bx, by, bz, qx, qy, qz = traverse(
+                voxels[i], oy, ox, oz, position[i, 0], position[i, 1], position[i, 2],
+                math.cos(math.radians(yaw - 90)) * m, math.sin(math.radians(pitch)),
+                math.sin(math.radians(yaw - 90)) * m, 8
+            )
+            block = active_block[i]
+            if add and has_previous and inventory[i, block - 1] > 0 \
+                    and -5 <= qx <= 5 and -5 <= qz <= 5 and -1 <= qy < 8:
+                x, z = position[i, 0], position[i, 2]
+                y = position[i, 1] - (PLAYER_HEIGHT - 1) + pad
+                if not (qx - 0.5 <= x <= qx + 0.5 and qz - 0.5 <= z <= qz + 0.5
+                        and (qy <= y <= qy + 1 or qy <= (y + 1) <= qy + 1)):
+                    voxels[i, qy + oy, qx + ox, qz + oz] = block
+                    inventory[i, block - 1] -= 1
+                    changes[i, 0], changes[i, 1], changes[i, 2] = qy + 1, qx + 5, qz + 5
+                    changes[i, 3], changes[i, 4] = 0, block
+            if remove and hit:
+                texture = voxels[i, by + oy, bx + ox, bz + oz]
+                # ground blocks have negative ids in the voxel array
+                if texture > 0:
+                    voxels[i, by + oy, bx + ox, bz + oz] = 0
+                    inventory[i, texture - 1] += 1
+                    changes[i, 0], changes[i, 1], changes[i, 2] = by + 1, bx + 5, bz + 5
+                    changes[i, 3], changes[i, 4] = texture, 0
+        # update
+        x, y, z, agent_dy[i], time_int_steps[i] = update(
+            voxels[i], oy, ox, oz, position[i, 0], position[i, 1], position[i, 2],
+            yaw, pitch, strafe_x, strafe_z, False, agent_dy[i], time_int_steps[i], dt, pad
+        )
+        position[i, 0], position[i, 1], position[i, 2] = x, y, z
+        while yaw > 360.:
+            yaw -= 360.
+        while yaw < 0.:
+            yaw += 360.
+        rotation[i, 0], rotation[i, 1] = yaw, pitch
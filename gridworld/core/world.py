@@ -1,9 +1,13 @@
 import math
 from typing import Optional
 
+import numpy as np
+
 from ..utils import WHITE, GREY, BLUE, FACES
 from ..utils import FLYING_SPEED, WALKING_SPEED, GRAVITY, TERMINAL_VELOCITY, PLAYER_HEIGHT, JUMP_SPEED
+from ..utils import GROUND_LEVEL, GROUND_SIZE
 from ..utils import normalize
+from . import kernels
 
 class Agent:
     PAD = 0.25
@@ -29,20 +33,52 @@ class Agent:
         self.active_block = BLUE
 
 class World:
-    __slots__ = 'world', 'shown', 'placed', 'callbacks', 'initialized'
+    __slots__ = 'world', 'shown', 'placed', 'callbacks', 'initialized', 'version'
     def __init__(self):
         self.world = {}
         self.shown = {}
         self.placed = set()
+        # bulk mutations (.set_blocks, .remove_blocks) only notify the *_many callbacks
         self.callbacks = {
             'on_add': [],
-            'on_remove': []
+            'on_remove': [],
+            'on_add_many': [],
+            'on_remove_many': []
         }
         self.initialized = False
+        # incremented on every block change
+        self.version = 0
 
     def add_callback(self, name, func):
         self.callbacks[name].append(func)
 
+    def __len__(self):
+        return len(self.world)
+
+    def get_block(self, position):
+        """ Returns the texture id of the block at `position` or None if
+        there is no block.
+
+        """
+        texture = self.world.get(position)
+        if texture is None:
+            return self.ground(*position)
+        return texture
+
+    def ground(self, x, y, z):
+        """ Returns the texture id of the ground block at (x, y, z) or None
+        if the position is not on the ground.
+
+        The ground is implicit: it is not stored in `world` and adding or
+        removing blocks never touches it. It exists while the world is
+        initialized.
+
+        """
+        if y != GROUND_LEVEL or not self.initialized \
+           or not (-GROUND_SIZE <= x <= GROUND_SIZE and -GROUND_SIZE <= z <= GROUND_SIZE):
+            return None
+        return WHITE if self.build_zone(x, 0, z) else GREY
+
     ### BLOCKS RELATED METHODS
     def deinit(self):
         for block in list(self.placed):
@@ -57,17 +93,37 @@ class World:
     def build_zone(self, x, y, z, pad=0):
         return -5 - pad <= x <= 5 + pad and -5 - pad <= z <= 5 + pad and -1 - pad <= y < 8 + pad
 
+    @staticmethod
+    def build_zone_mask(positions):
+        """ Vectorized `build_zone` for an (N, 3) array of positions.
+
+        """
+        x, y, z = positions[:, 0], positions[:, 1], positions[:, 2]
+        return (-5 <= x) & (x <= 5) & (-5 <= z) & (z <= 5) & (-1 <= y) & (y < 8)
+
+    @staticmethod
+    def _unique_blocks(positions, textures=None):
+        """ Converts `positions` and `textures` to arrays, keeping only the
+        last block at each position. Also returns the positions as tuples.
+
+        """
+        positions = np.asarray(positions, dtype=np.int64).reshape(-1, 3)
+        keys = list(map(tuple, positions.tolist()))
+        if textures is not None:
+            textures = np.asarray(textures, dtype=np.int64).reshape(-1)
+        last = dict(zip(keys, range(len(keys))))
+        if len(last) != len(keys):
+            idx = np.fromiter(last.values(), dtype=np.int64, count=len(last))
+            positions, keys = positions[idx], list(last.keys())
+            if textures is not None:
+                textures = textures[idx]
+        return positions, keys, textures
+
     def _initialize(self):
-        """ Initialize the world by placing all the blocks.
+        """ Initialize the world. The ground is not stored as blocks,
+        see `.ground`.
 
         """
-        n = 18  # 1/2 width and height of world
-        s = 1  # step size
-        y = 0  # initial y height
-        for x in range(-n, n + 1, s):
-            for z in range(-n, n + 1, s):
-                color = GREY if not self.build_zone(x, y, z) else WHITE
-                self.add_block((x, y - 2, z), color)
         self.initialized = True
 
     def hit_test(self, position, vector, max_distance=8):
@@ -76,6 +132,10 @@ class World:
         intersected it is returned, along with the block previously in the line
         of sight. If no block is found, return None, None.
 
+        The search is an exact voxel traversal (Amanatides & Woo): each block
+        crossed by the ray is visited exactly once, so the previous block
+        always shares a face with the intersected one.
+
         Parameters
         ----------
         position : tuple of len 3
@@ -86,17 +146,77 @@ class World:
             How many blocks away to search for a hit.
 
         """
-        m = 5
         x, y, z = position
-        dx, dy, dz = vector
-        previous = None
-        for _ in range(max_distance * m):
-            key = normalize((x, y, z))
-            if key != previous and key in self.world:
-                return key, previous
-            previous = key
-            x, y, z = x + dx / m, y + dy / m, z + dz / m
-        return None, None
+        key = normalize(position)
+        if key in self.world or self.ground(*key) is not None:
+            return key, None
+        key = list(key)
+        p = (x, y, z)
+        step = [0, 0, 0]
+        t_max = [math.inf] * 3
+        t_delta = [math.inf] * 3
+        for i, d in enumerate(vector):
+            if d > 0:
+                step[i] = 1
+            elif d < 0:
+                step[i] = -1
+            else:
+                continue
+            # distance along the ray to the first block boundary and between boundaries
+            t_max[i] = (key[i] + 0.5 * step[i] - p[i]) / d
+            t_delta[i] = step[i] / d
+        previous = tuple(key)
+        while True:
+            i = t_max.index(min(t_max))
+            if t_max[i] > max_distance:
+                return None, None
+            key[i] += step[i]
+            t_max[i] += t_delta[i]
+            block = tuple(key)
+            if block in self.world or block[1] == GROUND_LEVEL and self.ground(*block) is not None:
+                return block, previous
+            previous = block
+
+    def hit_test_batch(self, positions, vectors, max_distance=8):
+        """
+        Batched version of `hit_test`.
+
+        Parameters
+        ----------
+        positions : np.ndarray of shape (N, 3)
+            The (x, y, z) positions to check visibility from.
+        vectors : np.ndarray of shape (N, 3)
+            The line of sight vectors.
+        max_distance : int
+            How many blocks away to search for a hit.
+
+        Returns
+        -------
+        blocks : np.ndarray of shape (N, 3)
+            Intersected blocks.
+        previous : np.ndarray of shape (N, 3)
+            Blocks previously in the line of sight.
+        hit : np.ndarray of shape (N,)
+            Whether a block was intersected.
+        has_previous : np.ndarray of shape (N,)
+            False where no block was intersected or where the position
+            is inside of a block.
+
+        """
+        n = len(positions)
+        blocks = np.zeros((n, 3), dtype=np.int64)
+        previous = np.zeros((n, 3), dtype=np.int64)
+        hit = np.zeros(n, dtype=bool)
+        has_previous = np.zeros(n, dtype=bool)
+        for j, (position, vector) in enumerate(zip(positions, vectors)):
+            block, prev = self.hit_test(tuple(position), tuple(vector), max_distance)
+            if block is not None:
+                hit[j] = True
+                blocks[j] = block
+            if prev is not None:
+                has_previous[j] = True
+                previous[j] = prev
+        return blocks, previous, hit, has_previous
 
     def add_block(self, position, texture):
         """ Add a block with the given `texture` and `position` to the world.
@@ -116,6 +236,7 @@ class World:
             self.remove_block(position)
         self.world[position] = texture
         self.shown[position] = texture
+        self.version += 1
         for cb in self.callbacks['on_add']:
             cb(position, texture, build_zone=self.build_zone(*position))
         if self.initialized:
@@ -133,12 +254,72 @@ class World:
 
         """
         del self.world[position]
+        self.version += 1
         if position in self.shown:
             self.shown.pop(position)
             for cb in self.callbacks['on_remove']:
                 cb(position, build_zone=self.build_zone(*position))
         if self.initialized:
             self.placed.remove(position)
+
+    def set_blocks(self, positions, textures):
+        """ Add many blocks at once. Same as calling `.add_block` for each
+        block, but callbacks are notified once through ``on_add_many``
+        (and ``on_remove_many`` for the replaced blocks).
+
+        Parameters
+        ----------
+        positions : array-like of shape (N, 3)
+            The (x, y, z) positions of the blocks to add.
+        textures : array-like of shape (N,)
+            Block ids of the blocks.
+
+        """
+        positions, keys, textures = self._unique_blocks(positions, textures)
+        if len(keys) == 0:
+            return
+        replaced = [key for key in keys if key in self.world]
+        if replaced:
+            self.remove_blocks(replaced)
+        for key, texture in zip(keys, textures.tolist()):
+            self.world[key] = texture
+            self.shown[key] = texture
+        self.version += 1
+        build_zone = self.build_zone_mask(positions)
+        for cb in self.callbacks['on_add_many']:
+            cb(positions, textures, build_zone=build_zone)
+        if self.initialized:
+            self.placed.update(keys)
+
+    def remove_blocks(self, positions):
+        """ Remove many blocks at once. Same as calling `.remove_block` for
+        each position, but callbacks are notified once through ``on_remove_many``.
+
+        Parameters
+        ----------
+        positions : array-like of shape (N, 3)
+            The (x, y, z) positions of the blocks to remove.
+
+        """
+        positions, keys, _ = self._unique_blocks(positions)
+        if len(keys) == 0:
+            return
+        for key in keys:
+            if key not in self.world:
+                raise KeyError(key)
+        for key in keys:
+            del self.world[key]
+        self.version += 1
+        shown = [key in self.shown for key in keys]
+        for key in keys:
+            self.shown.pop(key, None)
+        if any(shown):
+            positions = positions[shown]
+            build_zone = self.build_zone_mask(positions)
+            for cb in self.callbacks['on_remove_many']:
+                cb(positions, build_zone=build_zone)
+        if self.initialized:
+            self.placed.difference_update(keys)
     ### END BLOCKS RELATED METHODS
 
     ### AGENT CONTROL METHODS
@@ -299,7 +480,8 @@ class World:
                     op[1] -= dy
                     op[i] += face[i]
                     if tuple(op) not in self.world \
-                       and (new_blocks is None or tuple(op) not in new_blocks):
+                       and (new_blocks is None or tuple(op) not in new_blocks) \
+                       and self.ground(*op) is None:
                         continue
                     p[i] -= (d - pad) * face[i]
                     if face == (0, -1, 0) or face == (0, 1, 0):
@@ -310,6 +492,15 @@ class World:
         return tuple(p)
 
     def place_or_remove_block(self, agent, remove: bool, place: bool):
+        """ Places the active block or removes the focused one.
+
+        Returns
+        -------
+        change : tuple or None
+            ``(position, old, new)`` position and block ids (None for no block)
+            before and after the change, None if nothing changed.
+
+        """
         if place and remove or not place and not remove: return
         vector = self.get_sight_vector(agent)
         block, previous = self.hit_test(agent.position, vector)
@@ -325,11 +516,13 @@ class World:
                        and (by <= y <= by + 1 or by <= (y + 1) <= by + 1)):
                         self.add_block(previous, agent.active_block)
                         agent.inventory[agent.active_block - 1] -= 1
+                        return previous, None, agent.active_block
         if remove and block:
-            texture = self.world[block]
+            texture = self.get_block(block)
             if texture != GREY and texture != WHITE:
                 self.remove_block(block)
                 agent.inventory[texture - 1] += 1
+                return block, texture, None
 
     def get_focused_block(self, agent):
         vector = self.get_sight_vector(agent)
@@ -446,7 +639,7 @@ class World:
             remove = False
         self.movement(agent, strafe=strafe, dy=dy, inventory=inventory)
         self.move_camera(agent, *camera)
-        self.place_or_remove_block(agent, remove=remove, place=add)
+        change = self.place_or_remove_block(agent, remove=remove, place=add)
         self.update(agent, dt=1/20.)
         yaw, pitch = agent.rotation
         while yaw > 360.:
@@ -454,4 +647,238 @@ class World:
         while yaw < 0.0:
             yaw += 360.0
         agent.rotation = (yaw, pitch)
+        # see .place_or_remove_block
+        return change
     ### END UNIFIED AGENT CONTROL
+
+
+class ArrayWorld(World):
+    """ World that keeps its blocks in a dense int8 voxel array instead of
+    dicts keyed by position tuples.
+
+    The array covers the ground plane (x, z in [-18, 18], y = -2) and the
+    build zone above it (y in [-1, 7]) and is indexed as ``[y, x, z]``.
+    Empty cells hold ``AIR``; since the ``GREY`` texture id is zero as well,
+    grey blocks are stored as ``GREY_CODE``. Blocks can only be added within
+    the array bounds. The ground is written into its layer of the array
+    directly, without creating blocks, so the compiled kernels see it as
+    any other solid cell.
+    """
+    __slots__ = 'voxels',
+    SHAPE = (10, 37, 37)
+    # array index of the world origin (y, x, z)
+    OFFSET = (2, 18, 18)
+    AIR = 0
+    GREY_CODE = -2
+
+    def __init__(self):
+        super().__init__()
+        self.voxels = np.zeros(self.SHAPE, dtype=np.int8)
+
+    @property
+    def grid(self):
+        """ A view (not a copy) of the build zone part of the voxel array.
+
+        It has the same (9, 11, 11) layout as `GridWorld.grid` and is
+        updated in place as blocks are added and removed.
+        """
+        oy, ox, oz = self.OFFSET
+        return self.voxels[oy - 1:oy + 8, ox - 5:ox + 6, oz - 5:oz + 6]
+
+    def _index(self, position):
+        x, y, z = position
+        oy, ox, oz = self.OFFSET
+        sy, sx, sz = self.SHAPE
+        y, x, z = y + oy, x + ox, z + oz
+        if 0 <= y < sy and 0 <= x < sx and 0 <= z < sz:
+            return y, x, z
+        return None
+
+    def _empty(self, position):
+        # the code a cell holds when no block is there: the ground is
+        # implicit, so removing a block on it puts the ground back
+        code = self.ground(*position)
+        if code is None:
+            return self.AIR
+        return self.GREY_CODE if code == GREY else code
+
+    def _empty_many(self, positions):
+        empty = np.full(len(positions), self.AIR, dtype=np.int8)
+        if self.initialized:
+            for j in np.flatnonzero(positions[:, 1] == GROUND_LEVEL):
+                empty[j] = self._empty(tuple(positions[j].tolist()))
+        return empty
+
+    def __len__(self):
+        # the ground layer isn't counted, as in `World`
+        return int(np.count_nonzero(self.voxels[self.OFFSET[0] + GROUND_LEVEL + 1:]))
+
+    def _initialize(self):
+        oy, ox, oz = self.OFFSET
+        ground = self.voxels[oy + GROUND_LEVEL]
+        ground[...] = self.GREY_CODE
+        ground[ox - 5:ox + 6, oz - 5:oz + 6] = WHITE
+        self.initialized = True
+
+    def get_block(self, position):
+        idx = self._index(position)
+        if idx is None:
+            return None
+        code = self.voxels[idx]
+        if code == self.AIR:
+            return None
+        return GREY if code == self.GREY_CODE else int(code)
+
+    def deinit(self):
+        for block in list(self.placed):
+            self.remove_block(block)
+        self.initialized = False
+        oy, ox, oz = self.OFFSET
+        self.voxels[oy + GROUND_LEVEL] = self.AIR
+        for y, x, z in zip(*self.voxels.nonzero()):
+            self.remove_block((int(x) - ox, int(y) - oy, int(z) - oz))
+        self.voxels[...] = self.AIR
+        self.placed = set()
+
+    def hit_test(self, position, vector, max_distance=8):
+        x, y, z = position
+        dx, dy, dz = vector
+        hit, has_previous, bx, by, bz, qx, qy, qz = kernels.traverse(
+            self.voxels, *self.OFFSET, x, y, z, dx, dy, dz, max_distance)
+        if not hit:
+            return None, None
+        return (bx, by, bz), ((qx, qy, qz) if has_previous else None)
+
+    def hit_test_batch(self, positions, vectors, max_distance=8):
+        positions = np.ascontiguousarray(positions, dtype=np.float64)
+        vectors = np.ascontiguousarray(vectors, dtype=np.float64)
+        return kernels.traverse_batch(self.voxels, *self.OFFSET, positions, vectors, max_distance)
+
+    def add_block(self, position, texture):
+        idx = self._index(position)
+        if idx is None:
+            raise ValueError(f'Block position {position} is outside of the world bounds')
+        if self.voxels[idx] != self._empty(position):
+            self.remove_block(position)
+        self.voxels[idx] = self.GREY_CODE if texture == GREY else texture
+        self.version += 1
+        for cb in self.callbacks['on_add']:
+            cb(position, texture, build_zone=self.build_zone(*position))
+        if self.initialized:
+            self.placed.add(position)
+
+    def remove_block(self, position):
+        idx = self._index(position)
+        empty = self._empty(position)
+        if idx is None or self.voxels[idx] == empty:
+            raise KeyError(position)
+        if self.initialized and position not in self.placed:
+            raise KeyError(position)
+        self.voxels[idx] = empty
+        self.version += 1
+        for cb in self.callbacks['on_remove']:
+            cb(position, build_zone=self.build_zone(*position))
+        if self.initialized:
+            self.placed.remove(position)
+
+    def set_blocks(self, positions, textures):
+        positions, keys, textures = self._unique_blocks(positions, textures)
+        if len(keys) == 0:
+            return
+        oy, ox, oz = self.OFFSET
+        idx = positions[:, 1] + oy, positions[:, 0] + ox, positions[:, 2] + oz
+        inside = np.all([(i >= 0) & (i < n) for i, n in zip(idx, self.SHAPE)], axis=0)
+        if not inside.all():
+            raise ValueError(f'Block position {keys[np.argmin(inside)]} is outside of the world bounds')
+        replaced = self.voxels[idx] != self._empty_many(positions)
+        if replaced.any():
+            self.remove_blocks(positions[replaced])
+        self.voxels[idx] = np.where(textures == GREY, self.GREY_CODE, textures)
+        self.version += 1
+        build_zone = self.build_zone_mask(positions)
+        for cb in self.callbacks['on_add_many']:
+            cb(positions, textures, build_zone=build_zone)
+        if self.initialized:
+            self.placed.update(keys)
+
+    def remove_blocks(self, positions):
+        positions, keys, _ = self._unique_blocks(positions)
+        if len(keys) == 0:
+            return
+        oy, ox, oz = self.OFFSET
+        idx = positions[:, 1] + oy, positions[:, 0] + ox, positions[:, 2] + oz
+        inside = np.all([(i >= 0) & (i < n) for i, n in zip(idx, self.SHAPE)], axis=0)
+        if not inside.all():
+            raise KeyError(keys[np.argmin(inside)])
+        empty = self._empty_many(positions)
+        missing = self.voxels[idx] == empty
+        if self.initialized:
+            missing |= np.array([key not in self.placed for key in keys])
+        if missing.any():
+            raise KeyError(keys[np.argmax(missing)])
+        self.voxels[idx] = empty
+        self.version += 1
+        build_zone = self.build_zone_mask(positions)
+        for cb in self.callbacks['on_remove_many']:
+            cb(positions, build_zone=build_zone)
+        if self.initialized:
+            self.placed.difference_update(keys)
+
+    def update(self, agent, dt=1.0/5):
+        """ Runs the physics update as a single compiled kernel. See `World.update`,
+        which is kept as the reference implementation.
+
+        """
+        x, y, z = agent.position
+        yaw, pitch = agent.rotation
+        strafe_x, strafe_z = agent.strafe
+        x, y, z, agent.dy, agent.time_int_steps = kernels.update(
+            self.voxels, *self.OFFSET, float(x), float(y), float(z),
+            float(yaw), float(pitch), float(strafe_x), float(strafe_z),
+            agent.flying, float(agent.dy), agent.time_int_steps, float(dt), Agent.PAD
+        )
+        agent.position = (x, y, z)
+        if not agent.sustain:
+            agent.strafe = [0, 0]
+            if agent.flying:
+                agent.dy = 0
+
+    def collide(self, agent, position, height, new_blocks=None):
+        if new_blocks is None:
+            x, y, z = position
+            x, y, z, agent.dy = kernels.collide(
+                self.voxels, *self.OFFSET, float(x), float(y), float(z),
+                height, Agent.PAD, float(agent.dy)
+            )
+            return x, y, z
+        # extra blocks are not known to the compiled kernel
+        pad = Agent.PAD
+        p = list(position)
+        cell = normalize(position)
+        voxels = self.voxels
+        oy, ox, oz = self.OFFSET
+        sy, sx, sz = self.SHAPE
+        for face in FACES:  # check all surrounding blocks
+            for i in range(3):  # check each dimension independently
+                if not face[i]:
+                    continue
+                # How much overlap you have with this dimension.
+                d = (p[i] - cell[i]) * face[i]
+                if d < pad:
+                    continue
+                for dy in range(height):  # check each height
+                    op = list(cell)
+                    op[1] -= dy
+                    op[i] += face[i]
+                    bx, by, bz = op[0] + ox, op[1] + oy, op[2] + oz
+                    solid = 0 <= by < sy and 0 <= bx < sx and 0 <= bz < sz \
+                        and voxels.item(by, bx, bz) != self.AIR
+                    if not solid and tuple(op) not in new_blocks:
+                        continue
+                    p[i] -= (d - pad) * face[i]
+                    if face == (0, -1, 0) or face == (0, 1, 0):
+                        # You are colliding with the ground or ceiling, so stop
+                        # falling / rising.
+                        agent.dy = 0
+                    break
+        return tuple(p)
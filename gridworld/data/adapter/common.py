@@ -3,6 +3,7 @@ import numpy as np
 import logging
 
 from gridworld.tasks.task import BUILD_ZONE_SIZE
+from gridworld.tasks.blocks import BlockList
 
 RESOLUTION = (64, 64)
 
@@ -26,8 +27,8 @@ class VWEvent:
         self.actions = list(actions)
         if grid is None:
             grid = []
-        assert isinstance(grid, (list, tuple))
-        self.grid = list(grid) # grid in sparse format
+        assert isinstance(grid, (list, tuple, BlockList))
+        self.grid = BlockList(grid) # grid in sparse format
         if camera is None:
             camera = np.array([0., 0.])
         if isinstance(camera, (list, tuple)):
@@ -49,7 +50,7 @@ class GameSession:
     dialogs: list = field(default_factory=list, repr=False)
     init_conds: dict = field(default_factory=dict, repr=False)
     name: str = None
-    target: np.ndarray = field(default_factory=lambda: np.zeros(BUILD_ZONE_SIZE, dtype=np.int), repr=False)
+    target: np.ndarray = field(default_factory=lambda: np.zeros(BUILD_ZONE_SIZE, dtype=np.int64), repr=False)
 
     def episode_steps(self):
         return sum([sum([len(ev.actions) for ev in event_step]) for event_step in self.events.values()])
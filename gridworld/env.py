@@ -1,13 +1,15 @@
 import warnings
 import os
-from gridworld.core.world import Agent, World
+from gridworld.core.world import Agent, World, ArrayWorld
 from gridworld.tasks.task import Task, Tasks
+from gridworld.tasks.blocks import BlockList
 
 from gym.spaces import Dict, Box, Discrete, Space
 from gym import Env, Wrapper as gymWrapper
 import gym
 import numpy as np
-from copy import copy
+from dataclasses import dataclass
+from collections import OrderedDict, deque
 
 class String(Space):
     def __init__(self, ):
@@ -23,23 +25,96 @@ class String(Space):
 
 
 
+def _task_state(task):
+    """
+    Returns shallow copies of the attributes of a task and of the subtask
+    it is currently on, if any.
+    """
+    if task is None:
+        return None
+    current = vars(task).get('current')
+    return dict(vars(task)), (dict(vars(current)) if isinstance(current, Task) else None)
+
+
+def _set_task_state(task, state):
+    if task is None:
+        return
+    attributes, current_attributes = state
+    vars(task).update(attributes)
+    if current_attributes is not None:
+        vars(task.current).update(current_attributes)
+
+
+@dataclass(frozen=True)
+class GridWorldState:
+    """
+    Immutable snapshot of a `GridWorld` produced by `GridWorld.get_state`.
+
+    Snapshots taken while the world doesn't change share the same read-only
+    `grid` array, so taking them is cheap. Task objects are stored by
+    reference along with the values of their mutable progress fields,
+    including the subtask a task set (e.g. `Subtasks`) is currently on.
+    """
+    position: tuple
+    rotation: tuple
+    dy: float
+    time_int_steps: int
+    strafe: tuple
+    flying: bool
+    inventory: tuple
+    active_block: int
+    grid: np.ndarray
+    step_no: int
+    max_int: int
+    prev_grid_size: int
+    task: object
+    # attributes of the task and of its current subtask, see _task_state
+    task_state: tuple
+    starting_grid: object
+    synthetic_task: object
+    synthetic_init_grid: np.ndarray
+    # (max_int, prev_grid_size, right_placement, wrong_placement, intersections) of the synthetic task
+    synthetic_task_state: tuple
+
+
 class GridWorld(Env):
     def __init__(
             self, render=True, max_steps=250, select_and_place=False,
             discretize=False, right_placement_scale=1., wrong_placement_scale=0.1,
             render_size=(64, 64), target_in_obs=False, action_space='walking', 
-            vector_state=True, fake=False, name='') -> None:
+            vector_state=True, fake=False, name='', world_storage='dict',
+            starting_worlds_pool=0, obs_keys=None, reuse_obs=False, frame_skip=1,
+            pixel_buffers=0) -> None:
+        if frame_skip < 1:
+            raise ValueError(f'frame_skip must be positive, got {frame_skip}')
         self.agent = Agent(sustain=False)
-        self.world = World()
-        self.grid = np.zeros((9, 11, 11), dtype=np.int32)
+        if world_storage == 'dict':
+            self.world = World()
+            self.grid = np.zeros((9, 11, 11), dtype=np.int32)
+            self.world.add_callback('on_add', self._add_block)
+            self.world.add_callback('on_remove', self._remove_block)
+            self.world.add_callback('on_add_many', self._add_blocks)
+            self.world.add_callback('on_remove_many', self._remove_blocks)
+        elif world_storage == 'array':
+            self.world = ArrayWorld()
+            # the build zone view of the voxel array is kept up to date by the world itself
+            self.grid = self.world.grid
+        else:
+            raise ValueError(f'Unknown world storage: {world_storage}')
+        self.world_storage = world_storage
+        # LRU cache of prepared starting worlds keyed by starting and target grids
+        self.starting_worlds_pool = starting_worlds_pool
+        self._starting_worlds = OrderedDict()
         self._task = None
         self._task_generator = None
         self.step_no = 0
         self.right_placement_scale = right_placement_scale
         self.wrong_placement_scale = wrong_placement_scale
         self.max_steps = max_steps
-        self.world.add_callback('on_add', self._add_block)
-        self.world.add_callback('on_remove', self._remove_block)
+        # number of world steps each action is repeated for
+        self.frame_skip = frame_skip
+        # number of pixel buffers the renderer reads pov frames back into asynchronously, see .step_many
+        self.pixel_buffers = pixel_buffers
         self.right_placement = 0
         self.wrong_placement = 0
         self.render_size = render_size
@@ -53,6 +128,10 @@ class GridWorld(Env):
         self._overwrite_starting_grid = None
         self.initial_position = (0, 0, 0)
         self.initial_rotation = (0, 0)
+        # (world version, read-only grid copy) shared by the snapshots of an unchanged world
+        self._state_grid = (None, None)
+        # world version right after the last step, to detect changes made outside of .step
+        self._step_version = None
         if action_space == 'walking':
             if discretize:
                 self.action_space = Discrete(18)
@@ -92,8 +171,26 @@ class GridWorld(Env):
             self.observation_space['target_grid'] = Box(low=-1, high=7, shape=(9, 11, 11), dtype=np.int32)
         if render:
             self.observation_space['pov'] = Box(low=0, high=255, shape=(*self.render_size, 3), dtype=np.uint8)
+        if obs_keys is not None:
+            unknown = set(obs_keys) - self.observation_space.keys()
+            if unknown:
+                raise ValueError(f'Unknown observation keys: {sorted(unknown)}, '
+                                 f'available: {sorted(self.observation_space)}')
+            self.observation_space = {k: v for k, v in self.observation_space.items() if k in obs_keys}
         self.observation_space = Dict(self.observation_space)
+        # keys of the observation in the order they are computed
+        self.obs_keys = [k for k in ['inventory', 'compass', 'dialog', 'grid', 'agentPos', 'target_grid', 'pov']
+                         if k in self.observation_space.spaces]
+        # arrays that observations are written into, see .set_obs_buffers
+        self.obs_buffers = None
+        if reuse_obs:
+            self.set_obs_buffers()
         self.max_int = 0
+        self.prev_grid_size = 0
+        self._synthetic_task = None
+        self._synthetic_init_grid = None
+        # reused by every step for the grid of the synthetic task
+        self._synthetic_grid = np.zeros((9, 11, 11), dtype=np.int64)
         self.name = name
         self.do_render = render
         if render and not fake:
@@ -108,7 +205,7 @@ class GridWorld(Env):
                 div = 1                
             self.renderer = Renderer(self.world, self.agent,
                                      width=self.render_size[0] // div, height=self.render_size[1] // div,
-                                     caption='Pyglet', resizable=False)
+                                     caption='Pyglet', resizable=False, pixel_buffers=self.pixel_buffers)
             setup()
         else:
             self.renderer = None
@@ -129,7 +226,7 @@ class GridWorld(Env):
             self.world.deinit()
             self.renderer = Renderer(self.world, self.agent,
                                      width=self.render_size[0] // div, height=self.render_size[1] // div,
-                                     caption='Pyglet', resizable=False)
+                                     caption='Pyglet', resizable=False, pixel_buffers=self.pixel_buffers)
             setup()
             self.do_render = True
 
@@ -152,6 +249,20 @@ class GridWorld(Env):
                                  f'grid state: {self.grid.nonzero()[0]};')
             self.grid[y, x, z] = 0
 
+    def _add_blocks(self, positions, kinds, build_zone):
+        if self.world.initialized:
+            x, y, z = positions[build_zone].T
+            self.grid[y + 1, x + 5, z + 5] = kinds[build_zone]
+
+    def _remove_blocks(self, positions, build_zone):
+        if self.world.initialized:
+            x, y, z = positions[build_zone].T
+            y, x, z = y + 1, x + 5, z + 5
+            if (self.grid[y, x, z] == 0).any():
+                raise ValueError(f'Removal of non-existing block. address: y={y}, x={x}, z={z}; '
+                                 f'grid state: {self.grid.nonzero()[0]};')
+            self.grid[y, x, z] = 0
+
     def set_task(self, task: Task):
         """
         Assigns provided task into the environment. On each .reset, the env
@@ -221,21 +332,19 @@ class GridWorld(Env):
         else:
             self.starting_grid = self._task.starting_grid
         
-        self._synthetic_init_grid = None
-        if self.starting_grid is not None:
-            self._synthetic_init_grid = Tasks.to_dense(self.starting_grid)
-            self._synthetic_task = Task(
-                # create a synthetic task with only diff blocks. 
-                # blocks to remove have negative ids.
-                '', target_grid=self._task.target_grid - self._synthetic_init_grid
-            )
-            self._synthetic_task.reset()
-
-        for block in set(self.world.placed):
-            self.world.remove_block(block)
-        if self.starting_grid is not None:
-            for x,y,z, bid in self.starting_grid:
-                self.world.add_block((x, y, z), bid)
+        # tasks without a starting structure start from an empty build zone
+        starting_grid = self.starting_grid if self.starting_grid is not None else []
+        blocks, self._synthetic_init_grid, self._synthetic_task = \
+            self._get_starting_world(starting_grid, self._task.target_grid)
+        self._synthetic_task.reset()
+        # apply only the difference between the current and the starting structures
+        self.world.remove_blocks(list(self.world.placed - blocks.keys()))
+        added = [(position, bid) for position, bid in blocks.items()
+                 if self.world.get_block(position) != bid]
+        if added:
+            positions, bids = zip(*added)
+            self.world.set_blocks(positions, bids)
+        self._step_version = self.world.version
         self.agent.position = self.initial_position
         self.agent.rotation = self.initial_rotation
         self.max_int = self._task.maximal_intersection(self.grid)
@@ -244,28 +353,177 @@ class GridWorld(Env):
         if self.starting_grid is not None:
             for _, _, _, color in self.starting_grid:
                 self.agent.inventory[color - 1] -= 1
-        obs = {
-            'inventory': np.array(self.agent.inventory, dtype=np.float32),
-            'compass': np.array([0.], dtype=np.float32),
-            'dialog': self._task.chat
-        }
-        if self.vector_state:
-            obs['grid'] = self.grid.copy().astype(np.int32)
-            obs['agentPos'] = np.array([0., 0., 0., 0., 0.], dtype=np.float32)
-        if self.target_in_obs:
-            obs['target_grid'] = self._task.target_grid.copy().astype(np.int32)
-        if self.do_render and not self.fake:
-            obs['pov'] = self.render()[..., :-1]
-        elif self.do_render:
-            obs['pov'] = self.observation_space['pov'].sample()
+        return self._get_obs(0., (0., 0., 0., 0., 0.))
+
+    def set_obs_buffers(self, buffers=None):
+        """
+        Makes `.reset` and `.step` write observations into reusable arrays
+        instead of allocating new ones. The returned observation dicts hold
+        these same arrays, so their content is only valid until the next call
+        of `.reset` or `.step`; copy whatever has to outlive it.
+
+        Args:
+            buffers (dict): optional arrays (e.g. rows of a batch or of shared
+                memory) to write the observations of the corresponding keys
+                into. Arrays for the other keys are allocated by the env.
+        """
+        buffers = dict(buffers or {})
+        for key, space in self.observation_space.spaces.items():
+            if not isinstance(space, Box):
+                continue
+            if key not in buffers:
+                buffers[key] = np.zeros(space.shape, dtype=space.dtype)
+            elif buffers[key].shape != space.shape or buffers[key].dtype != space.dtype:
+                raise ValueError(f'Buffer for {key} must be a {space.dtype} array of shape {space.shape}, '
+                                 f'got {buffers[key].dtype} array of shape {buffers[key].shape}')
+        unknown = buffers.keys() - self.observation_space.spaces.keys()
+        if unknown:
+            raise ValueError(f'Unknown observation keys: {sorted(unknown)}')
+        self.obs_buffers = buffers
+
+    def _get_obs(self, compass, agent_pos, keys=None, buffers=None):
+        """
+        Returns the observation of the given keys (`.obs_keys` by default),
+        written into `buffers` (`.obs_buffers` by default) if they are set.
+        """
+        if keys is None:
+            keys, buffers = self.obs_keys, self.obs_buffers
+        obs = {}
+        for key in keys:
+            if key == 'dialog':
+                obs[key] = self._task.chat
+                continue
+            if key == 'inventory':
+                value = self.agent.inventory
+            elif key == 'compass':
+                value = (compass,)
+            elif key == 'grid':
+                value = self.grid
+            elif key == 'agentPos':
+                value = agent_pos
+            elif key == 'target_grid':
+                value = self._task.target_grid
+            elif not self.fake:
+                if not self.do_render:
+                    raise ValueError('create env with render=True')
+                # the renderer reads frames back into the same array on every call
+                value = self.renderer.render_rgb()
+            else:
+                value = self.observation_space['pov'].sample()
+            if buffers is None:
+                obs[key] = np.array(value, dtype=self.observation_space[key].dtype)
+            else:
+                buffers[key][...] = value
+                obs[key] = buffers[key]
         return obs
 
+    def _get_starting_world(self, starting_grid, target_grid):
+        """
+        Returns the blocks of the starting structure as a position -> block id dict,
+        its dense grid and the synthetic task that only contains the diff blocks.
+        Recently used starting worlds are kept in a pool of `starting_worlds_pool` entries.
+        """
+        starting_grid = BlockList(starting_grid)
+        if self.starting_worlds_pool > 0:
+            key = (starting_grid.array.tobytes(), target_grid.tobytes())
+            if key in self._starting_worlds:
+                self._starting_worlds.move_to_end(key)
+                return self._starting_worlds[key]
+        blocks = dict(zip(map(tuple, starting_grid.positions.tolist()), starting_grid.ids.tolist()))
+        init_grid = starting_grid.to_dense()
+        init_grid.setflags(write=False)
+        synthetic_task = Task(
+            # create a synthetic task with only diff blocks.
+            # blocks to remove have negative ids.
+            '', target_grid=target_grid - init_grid
+        )
+        starting_world = blocks, init_grid, synthetic_task
+        if self.starting_worlds_pool > 0:
+            self._starting_worlds[key] = starting_world
+            if len(self._starting_worlds) > self.starting_worlds_pool:
+                self._starting_worlds.popitem(last=False)
+        return starting_world
+
+    def get_state(self) -> GridWorldState:
+        """
+        Returns an immutable snapshot of the environment: agent pose, velocity
+        and inventory, the built grid and the task progress.
+        The snapshot can be restored later with `.set_state`.
+        """
+        version, grid = self._state_grid
+        if version != self.world.version:
+            grid = self.grid.copy()
+            grid.setflags(write=False)
+            self._state_grid = (self.world.version, grid)
+        agent = self.agent
+        synthetic_task = self._synthetic_task
+        synthetic_task_state = None
+        if synthetic_task is not None:
+            synthetic_task_state = (
+                synthetic_task.max_int, synthetic_task.prev_grid_size,
+                synthetic_task.right_placement, synthetic_task.wrong_placement,
+                synthetic_task._scores
+            )
+        return GridWorldState(
+            position=tuple(agent.position), rotation=tuple(agent.rotation),
+            dy=agent.dy, time_int_steps=agent.time_int_steps,
+            strafe=tuple(agent.strafe), flying=agent.flying,
+            inventory=tuple(agent.inventory), active_block=agent.active_block,
+            grid=grid, step_no=self.step_no,
+            max_int=self.max_int, prev_grid_size=self.prev_grid_size,
+            task=self._task, task_state=_task_state(self._task),
+            starting_grid=self.starting_grid,
+            synthetic_task=synthetic_task,
+            synthetic_init_grid=self._synthetic_init_grid,
+            synthetic_task_state=synthetic_task_state
+        )
+
+    def set_state(self, state: GridWorldState):
+        """
+        Restores the environment to a snapshot taken by `.get_state`.
+        Only the blocks that differ between the current and the snapshot
+        grids are added or removed.
+        """
+        y, x, z = np.nonzero(self.grid != state.grid)
+        positions = np.stack([x - 5, y - 1, z - 5], axis=1)
+        removed = self.grid[y, x, z] != 0
+        self.world.remove_blocks(positions[removed])
+        added = state.grid[y, x, z] != 0
+        self.world.set_blocks(positions[added], state.grid[y, x, z][added])
+        self._state_grid = (self.world.version, state.grid)
+        self._step_version = self.world.version
+        agent = self.agent
+        agent.position = state.position
+        agent.rotation = state.rotation
+        agent.dy = state.dy
+        agent.time_int_steps = state.time_int_steps
+        agent.strafe = list(state.strafe)
+        agent.flying = state.flying
+        agent.inventory = list(state.inventory)
+        agent.active_block = state.active_block
+        self.step_no = state.step_no
+        self.max_int = state.max_int
+        self.prev_grid_size = state.prev_grid_size
+        self._task = state.task
+        _set_task_state(state.task, state.task_state)
+        self.starting_grid = state.starting_grid
+        self._synthetic_task = state.synthetic_task
+        self._synthetic_init_grid = state.synthetic_init_grid
+        if state.synthetic_task is not None:
+            (state.synthetic_task.max_int, state.synthetic_task.prev_grid_size,
+             state.synthetic_task.right_placement, state.synthetic_task.wrong_placement,
+             state.synthetic_task._scores) = state.synthetic_task_state
+
     def render(self,):
         if not self.do_render:
             raise ValueError('create env with render=True')
         return self.renderer.render()
 
-    def step(self, action):
+    def _step(self, action):
+        """
+        Repeats the action for `.frame_skip` world steps, stopping when the episode ends,
+        and returns the sum of their rewards and whether the episode is done.
+        """
         if self._task is None:
             if self._task_generator is None:
                 raise ValueError('Task is not initialized! Initialize task before working with'
@@ -273,39 +531,165 @@ class GridWorld(Env):
                                 '.set_task_generator method')
             else:
                 raise ValueError('Task is not initialized! Run .reset() first.')
+        reward = 0
+        for _ in range(self.frame_skip):
+            step_reward, done = self._world_step(action)
+            reward += step_reward
+            if done:
+                break
+        return reward, done
+
+    def _world_step(self, action):
+        """
+        Advances the world by one step and returns the reward and whether the episode is done.
+        """
         self.step_no += 1
-        self.world.step(
+        # blocks changed by this step, None if the world was modified elsewhere since the last step
+        changed = [] if self._step_version == self.world.version else None
+        change = self.world.step(
             self.agent, action, select_and_place=self.select_and_place,
             action_space=self.action_space_type, discretize=self.discretize
         )
-        x, y, z = self.agent.position
-        yaw, pitch = self.agent.rotation
-        obs = {}
-        obs['inventory'] = np.array(copy(self.agent.inventory), dtype=np.float32)
-        obs['compass'] = np.array([yaw - 180.,], dtype=np.float32)
-        obs['dialog'] = self._task.chat
-        if self.vector_state:
-            obs['grid'] = self.grid.copy().astype(np.int32)
-            obs['agentPos'] = np.array([x, y, z, pitch, yaw], dtype=np.float32)    
-        synthetic_grid = self.grid - self._synthetic_init_grid
-        right_placement, wrong_placement, done = self._synthetic_task.step_intersection(synthetic_grid)
+        self._step_version = self.world.version
+        if change is not None and changed is not None:
+            (x, y, z), old, new = change
+            if self.world.build_zone(x, y, z):
+                index = (y + 1, x + 5, z + 5)
+                init = self._synthetic_init_grid[index]
+                changed.append((index, (old or 0) - init, (new or 0) - init))
+        synthetic_grid = np.subtract(self.grid, self._synthetic_init_grid, out=self._synthetic_grid)
+        right_placement, wrong_placement, done = self._synthetic_task.step_intersection(synthetic_grid, changed)
         done = done or (self.step_no == self.max_steps)
         if right_placement == 0:
             reward = wrong_placement * self.wrong_placement_scale
         else:
             reward = right_placement * self.right_placement_scale
-        if self.target_in_obs:
-            obs['target_grid'] = self._task.target_grid.copy().astype(np.int32)
-        if self.do_render and not self.fake:
-            obs['pov'] = self.render()[..., :-1]
-        elif self.do_render:
-            obs['pov'] = self.observation_space['pov'].sample()
-        return obs, reward, done, {}
+        return reward, done
+
+    def _step_obs(self, keys=None, buffers=None):
+        x, y, z = self.agent.position
+        yaw, pitch = self.agent.rotation
+        return self._get_obs(yaw - 180., (x, y, z, pitch, yaw), keys, buffers)
+
+    def _check_obs_keys(self, keys):
+        unknown = set(keys) - set(self.obs_keys)
+        if unknown:
+            raise ValueError(f'Unknown observation keys: {sorted(unknown)}, available: {self.obs_keys}')
+        return [key for key in self.obs_keys if key in keys]
+
+    def step(self, action):
+        reward, done = self._step(action)
+        return self._step_obs(), reward, done, {}
+
+    def step_many(self, actions, obs_keys=None, last_obs_keys=None):
+        """
+        Runs a sequence of actions inside the environment and stops after
+        the step that ends the episode. Equivalent to calling `.step` for
+        each action, but observations are only computed for the requested keys.
+        If the env was created with `pixel_buffers` > 0, the readback of the
+        pov frame of each step overlaps the following steps.
+
+        Args:
+            actions: sequence of actions
+            obs_keys (list): keys of the observations to return for every step,
+                all by default. Pass [] to get rewards and dones only.
+            last_obs_keys (list): keys of the observation after the last step,
+                returned in ``info['last_observation']``, all by default.
+
+        Returns:
+            obs (dict): observations of each step stacked into arrays of shape
+                (T, ...), dialogs as lists, where T is the number of steps taken;
+            rewards (np.ndarray): rewards of each step;
+            dones (np.ndarray): whether the episode is done after each step;
+            info (dict): info of the last step.
+        """
+        keys = self.obs_keys if obs_keys is None else self._check_obs_keys(obs_keys)
+        last_keys = self.obs_keys if last_obs_keys is None else self._check_obs_keys(last_obs_keys)
+        obs = {
+            key: [] if key == 'dialog' else np.zeros((len(actions), *self.observation_space[key].shape),
+                                                     dtype=self.observation_space[key].dtype)
+            for key in keys
+        }
+        rewards = np.zeros(len(actions), dtype=np.float64)
+        dones = np.zeros(len(actions), dtype=bool)
+        # steps whose pov frames are requested from the renderer but not read yet
+        requested = None
+        if 'pov' in keys and not self.fake and self.do_render and self.pixel_buffers > 0:
+            requested = deque()
+            keys = [key for key in keys if key != 'pov']
+        steps = 0
+        for action in actions:
+            rewards[steps], dones[steps] = self._step(action)
+            if keys:
+                step_obs = self._step_obs(keys, {key: obs[key][steps] for key in keys if key != 'dialog'})
+                if 'dialog' in obs:
+                    obs['dialog'].append(step_obs['dialog'])
+            if requested is not None:
+                if len(requested) == self.pixel_buffers:
+                    obs['pov'][requested.popleft()] = self.renderer.render_rgb()
+                self.renderer.request_rgb()
+                requested.append(steps)
+            steps += 1
+            if dones[steps - 1]:
+                break
+        while requested:
+            obs['pov'][requested.popleft()] = self.renderer.render_rgb()
+        obs = {key: value[:steps] for key, value in obs.items()}
+        info = {'last_observation': self._step_obs(last_keys, self.obs_buffers)}
+        return obs, rewards[:steps], dones[:steps], info
+
+
+def step_sequence(env, actions, obs_keys=None, last_obs_keys=None):
+    """
+    Runs a sequence of actions through `env.step` and stacks the results as
+    `GridWorld.step_many` does. Used by wrappers whose `.step` changes
+    observations or rewards in a way `.step_many` can't reproduce.
+    """
+    rewards = np.zeros(len(actions), dtype=np.float64)
+    dones = np.zeros(len(actions), dtype=bool)
+    stacked = None
+    obs, info = {}, {}
+    steps = 0
+    for action in actions:
+        obs, rewards[steps], dones[steps], info = env.step(action)
+        keys = list(obs) if obs_keys is None else obs_keys
+        if stacked is None:
+            stacked = {key: [] for key in keys}
+        for key in keys:
+            stacked[key].append(obs[key].copy() if isinstance(obs[key], np.ndarray) else obs[key])
+        steps += 1
+        if dones[steps - 1]:
+            break
+    stacked = {key: value if key == 'dialog' else np.stack(value) for key, value in (stacked or {}).items()}
+    last_keys = list(obs) if last_obs_keys is None else last_obs_keys
+    info = dict(info, last_observation={key: obs[key] for key in last_keys if key in obs})
+    return stacked, rewards[:steps], dones[:steps], info
+
+
+def step_many(env, actions, obs_keys=None, last_obs_keys=None):
+    """
+    Runs a sequence of actions with `env.step_many` if the class of `env`
+    implements it, otherwise with `step_sequence`. Wrappers that don't know
+    about `.step_many` (e.g. the ones of gym) would forward it to the env
+    they wrap through `__getattr__` and skip their own `.step`.
+    """
+    if getattr(type(env), 'step_many', None) is None:
+        return step_sequence(env, actions, obs_keys=obs_keys, last_obs_keys=last_obs_keys)
+    return env.step_many(actions, obs_keys=obs_keys, last_obs_keys=last_obs_keys)
 
 
 class Wrapper(gymWrapper):
     def __getattr__(self, name):
         return getattr(self.env, name)
+
+    def step_many(self, actions, obs_keys=None, last_obs_keys=None):
+        """
+        See `GridWorld.step_many`. Wrappers that don't override `.step`
+        pass the whole sequence to the wrapped env, see `step_many`.
+        """
+        if type(self).step is Wrapper.step:
+            return step_many(self.env, actions, obs_keys=obs_keys, last_obs_keys=last_obs_keys)
+        return step_sequence(self, actions, obs_keys=obs_keys, last_obs_keys=last_obs_keys)
     
     def render(self, mode="human", **kwargs):
         if isinstance(self.env, GridWorld):
@@ -330,11 +714,25 @@ class SizeReward(Wrapper):
     reward += min(self.unwrapped.wrong_placement * 0.02, 0)
     return obs, reward, done, info
 
+  def step_many(self, actions, obs_keys=None, last_obs_keys=None):
+    obs, rewards, dones, info = step_many(self.env, actions, obs_keys=obs_keys, last_obs_keys=last_obs_keys)
+    # max_int and wrong_placement of the env only change on reset,
+    # so only the first step can increase the size
+    intersection = self.unwrapped.max_int
+    rewards = np.zeros(len(dones), dtype=np.float64)
+    if len(dones) > 0:
+      rewards[0] = max(intersection, self.size) - self.size
+      self.size = max(intersection, self.size)
+    rewards += min(self.unwrapped.wrong_placement * 0.02, 0)
+    return obs, rewards, dones, info
+
 def create_env(
         render=True, discretize=True, size_reward=True, select_and_place=True,
         right_placement_scale=1, render_size=(64, 64), target_in_obs=False,
         vector_state=False, max_steps=250, action_space='walking',
-        wrong_placement_scale=0.1, name='', fake=False
+        wrong_placement_scale=0.1, name='', fake=False, world_storage='dict',
+        starting_worlds_pool=0, obs_keys=None, reuse_obs=False, frame_skip=1,
+        pixel_buffers=0
     ):
     env = GridWorld(
         render=render, select_and_place=select_and_place,
@@ -342,7 +740,9 @@ def create_env(
         wrong_placement_scale=wrong_placement_scale, name=name,
         render_size=render_size, target_in_obs=target_in_obs,
         vector_state=vector_state, max_steps=max_steps,
-        action_space=action_space, fake=fake
+        action_space=action_space, fake=fake, world_storage=world_storage,
+        starting_worlds_pool=starting_worlds_pool, obs_keys=obs_keys, reuse_obs=reuse_obs,
+        frame_skip=frame_skip, pixel_buffers=pixel_buffers
     )
     if size_reward:
         env = SizeReward(env)
@@ -360,3 +760,9 @@ gym.envs.register(
      entry_point='gridworld.env:create_env',
      kwargs={'vector_state': True, 'render': False}
 )
+
+gym.envs.register(
+     id='IGLUGridworldVectorBatch-v0',
+     entry_point='gridworld.vector:VectorGridWorld',
+     kwargs={'vector_state': True, 'render': False}
+)
@@ -16,17 +16,45 @@ from pyglet import image
 import pyglet
 from filelock import FileLock
 import math
+import ctypes
 import numpy as np
 import os
 import time
 import platform
+import itertools
+from collections import deque
 from PIL import Image
 import gridworld
 
-from .utils import WHITE, GREY, cube_vertices, cube_normals, id2texture, id2top_texture
+from .utils import WHITE, GREY, GROUND_LEVEL, GROUND_SIZE, SECTOR_SIZE, FACES, normalize, \
+    cube_vertices, cube_normals, id2texture, id2top_texture
 
 _60FPS = 1./60
 PLATFORM = platform.system()
+# ARB_clip_control (core in OpenGL 4.5), which pyglet doesn't wrap
+GL_LOWER_LEFT = 0x8CA1
+GL_UPPER_LEFT = 0x8CA2
+GL_NEGATIVE_ONE_TO_ONE = 0x935E
+glClipControl = pyglet.gl.lib.link_GL('glClipControl', None, [GLenum, GLenum], requires='OpenGL 4.5')
+# blocks that only have a top face and don't hide the faces of their neighbors
+FLAT_BLOCKS = WHITE, GREY
+# vertices of the faces of a block at the origin, in the order of FACES
+FACE_VERTICES = np.array(cube_vertices(0, 0, 0, 0.5)).reshape(len(FACES), 12)
+# texture coordinates of the faces of each block, only the top face of flat blocks
+FACE_TEXTURES = {
+    texture_id: np.resize(
+        (id2top_texture if texture_id in FLAT_BLOCKS else id2texture)[texture_id], (len(FACES), 8)
+    )
+    for texture_id in id2texture
+}
+
+
+def sectorize(position):
+    """ Returns the (x, z) chunk of the block at `position`.
+
+    """
+    x, y, z = position
+    return x // SECTOR_SIZE, z // SECTOR_SIZE
 
 def setup_fog():
     """ Configure the OpenGL fog properties.
@@ -53,23 +81,55 @@ def setup():
 class Renderer(Window):
     TEXTURE_PATH = 'texture.png'
 
-    def __init__(self, model, agent, *args, **kwargs):
+    def __init__(self, model, agent, *args, pixel_buffers=0, **kwargs):
         super().__init__(*args, **kwargs)
         self.model = model
         self.agent = agent
+        # incremented whenever a shown block changes
+        self._revision = 0
+        # the last rendered frame and the view (position, rotation, size, revision) it was
+        # rendered at, reused until the world or the view changes
+        self._frame = None
+        self._frame_view = None
+        # offscreen framebuffer and the persistent RGB frame read back from it, see .render_rgb
+        self._fbo = None
+        self._rgb = None
+        self._rgb_view = None
+        # number of pixel buffer objects for asynchronous readbacks, see .request_rgb
+        self.pixel_buffers = pixel_buffers
+        self._pbos = None
+        self._next_pbo = 0
+        # (pixel buffer index or None if the frame is unchanged, view) of the requested frames
+        self._pending = deque()
+        # set while drawing offscreen without clip control, where the image is drawn upside down
+        self._flip_y = False
+        # whether the context supports glClipControl, see ._read_offscreen
+        self._clip_control = None
         self.model.add_callback('on_add', self.add_block)
         self.model.add_callback('on_remove', self.remove_block)
+        self.model.add_callback('on_add_many', self.add_blocks)
+        self.model.add_callback('on_remove_many', self.remove_blocks)
         self.batch = Batch()
         dir_path = os.path.dirname(gridworld.__file__)
         TEXTURE_PATH = os.path.join(dir_path, Renderer.TEXTURE_PATH)
         with FileLock(f'/tmp/mylock'):
             self.texture_group = TextureGroup(image.load(TEXTURE_PATH).get_texture())
         self.overlay = False
+        # texture ids of the shown blocks by position
         self._shown = {}
+        # positions of the shown blocks and a single vertex list of each chunk
+        self._chunk_blocks = {}
+        self._chunks = {}
+        # chunks whose vertex lists are rebuilt before the next draw
+        self._stale_chunks = set()
+        # vertex list of the hidden faces around the camera and the (camera block, revision) it was built at
+        self._near_faces = None
+        self._near_key = None
         self.label = pyglet.text.Label('', font_name='Arial', font_size=18,
             x=10, y=self.height - 10, anchor_x='left', anchor_y='top',
             color=(0, 0, 0, 255))
         self.model._initialize()
+        self._ground = self.add_ground()
         self.buffer_manager = pyglet.image.get_buffer_manager()
         self.last_frame_dt = 0
         self.realtime_rendering = os.environ.get('IGLU_RENDER_REALTIME', '0') == '1'
@@ -87,6 +147,8 @@ class Renderer(Window):
         glViewport(0, 0, max(1, viewport[0]), max(1, viewport[1]))
         glMatrixMode(GL_PROJECTION)
         glLoadIdentity()
+        if self._flip_y:
+            glScalef(1, -1, 1)
         glOrtho(0, max(1, width), 0, max(1, height), -1, 1)
         glMatrixMode(GL_MODELVIEW)
         glLoadIdentity()
@@ -101,6 +163,8 @@ class Renderer(Window):
         glViewport(0, 0, max(1, viewport[0]), max(1, viewport[1]))
         glMatrixMode(GL_PROJECTION)
         glLoadIdentity()
+        if self._flip_y:
+            glScalef(1, -1, 1)
         gluPerspective(90.0, width / float(height), 0.1, 30.0)
         glMatrixMode(GL_MODELVIEW)
         glLoadIdentity()
@@ -118,6 +182,8 @@ class Renderer(Window):
         self.clear()
         self.set_3d()
         glColor3d(1, 1, 1)
+        self.update_chunks()
+        self.update_near_faces()
         self.batch.draw()
 
         if self.overlay:
@@ -127,6 +193,15 @@ class Renderer(Window):
             self.draw_reticle()
 
     def render(self):
+        """ Returns the RGBA frame seen by the agent as a read-only array.
+        The previous frame is returned as is if neither the world nor
+        the agent's position and rotation have changed since it was rendered.
+
+        """
+        view = self._view()
+        if not self.overlay and view == self._frame_view:
+            # nothing visible has changed since the last frame
+            return self._frame
         if not pyglet.options['headless']:
             t = time.perf_counter()
             self.switch_to()
@@ -152,25 +227,302 @@ class Renderer(Window):
                     self.flip()
                 app.platform_event_loop.step(dt)
                 self.last_frame_dt = 0.
+        # the frame may be returned again by the next calls
+        rendered.flags.writeable = False
+        self._frame, self._frame_view = rendered, view
         return rendered
-        
 
-    def add_block(self, position, texture_id, **kwargs):
-        x, y, z = position
-        top_only = texture_id in [WHITE, GREY]
-        texture = (id2top_texture if top_only else id2texture)[texture_id]
-        vertex_data = cube_vertices(x, y, z, 0.5, top_only=top_only)
-        texture_data = list(texture)
-        # create vertex list
-        # FIXME Maybe `add_indexed()` should be used instead
-        self._shown[position] = self.batch.add(4 if top_only else 24, GL_QUADS, self.texture_group,
+    def _view(self):
+        return tuple(self.agent.position), tuple(self.agent.rotation), self.get_size(), self._revision
+
+    def _offscreen_resized(self):
+        """ Whether the offscreen framebuffer doesn't exist yet or doesn't
+        match the size of the viewport anymore.
+
+        """
+        width, height = self.get_viewport_size()
+        return self._rgb is None or self._rgb.shape[:2] != (height, width)
+
+    def _setup_offscreen(self):
+        """ Creates the offscreen framebuffer, the persistent RGB frame and
+        the pixel buffers in the context of the window at the size of the
+        viewport, deleting the previous ones if the window was resized.
+
+        """
+        if self._fbo is not None:
+            glDeleteFramebuffers(1, ctypes.byref(self._fbo))
+            glDeleteRenderbuffers(2, self._renderbuffers)
+            if self._pbos is not None:
+                glDeleteBuffers(self.pixel_buffers, self._pbos)
+                self._pbos = None
+        width, height = self.get_viewport_size()
+        self._fbo = GLuint()
+        glGenFramebuffers(1, ctypes.byref(self._fbo))
+        glBindFramebuffer(GL_FRAMEBUFFER, self._fbo)
+        self._renderbuffers = (GLuint * 2)()
+        glGenRenderbuffers(2, self._renderbuffers)
+        # keep the color depth of the window, so that frames match those of .render
+        color_format = GL_RGB565 if (self.config.red_size or 8) < 8 else GL_RGB8
+        for renderbuffer, internal_format, attachment in zip(
+                self._renderbuffers, (color_format, GL_DEPTH_COMPONENT24), (GL_COLOR_ATTACHMENT0, GL_DEPTH_ATTACHMENT)):
+            glBindRenderbuffer(GL_RENDERBUFFER, renderbuffer)
+            glRenderbufferStorage(GL_RENDERBUFFER, internal_format, width, height)
+            glFramebufferRenderbuffer(GL_FRAMEBUFFER, attachment, GL_RENDERBUFFER, renderbuffer)
+        status = glCheckFramebufferStatus(GL_FRAMEBUFFER)
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+        if status != GL_FRAMEBUFFER_COMPLETE:
+            raise RuntimeError(f'Offscreen framebuffer is incomplete, status: {status:#x}')
+        self._rgb = np.zeros((height, width, 3), dtype=np.uint8)
+        self._rgb_view = None
+        self._next_pbo = 0
+        if self.pixel_buffers:
+            self._pbos = (GLuint * self.pixel_buffers)()
+            glGenBuffers(self.pixel_buffers, self._pbos)
+            for pbo in self._pbos:
+                glBindBuffer(GL_PIXEL_PACK_BUFFER, pbo)
+                glBufferData(GL_PIXEL_PACK_BUFFER, self._rgb.nbytes, None, GL_STREAM_READ)
+            glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+
+    def _read_offscreen(self, pbo=None):
+        """ Draws the frame into the offscreen framebuffer and reads it back
+        into the persistent RGB frame or, asynchronously, into a pixel buffer.
+
+        """
+        self.switch_to()
+        if self._offscreen_resized():
+            self._setup_offscreen()
+        glBindFramebuffer(GL_FRAMEBUFFER, self._fbo)
+        if self._clip_control is None:
+            self._clip_control = gl_info.have_version(4, 5) or gl_info.have_extension('GL_ARB_clip_control')
+        if self._clip_control:
+            # an upper left origin makes the first row read back the top one and
+            # flips the image in the viewport transform, as window framebuffers do,
+            # so that frames match those of .render
+            glClipControl(GL_UPPER_LEFT, GL_NEGATIVE_ONE_TO_ONE)
+        else:
+            # flipping the projection instead also reverses the winding of the front
+            # faces; edges that fall on pixel centers (e.g. the horizon) may then be
+            # rasterized one row off compared to .render
+            self._flip_y = True
+            glFrontFace(GL_CW)
+        try:
+            self.on_draw()
+        finally:
+            if self._clip_control:
+                glClipControl(GL_LOWER_LEFT, GL_NEGATIVE_ONE_TO_ONE)
+            else:
+                self._flip_y = False
+                glFrontFace(GL_CCW)
+        height, width, _ = self._rgb.shape
+        glPixelStorei(GL_PACK_ALIGNMENT, 1)
+        if pbo is None:
+            glReadPixels(0, 0, width, height, GL_RGB, GL_UNSIGNED_BYTE, self._rgb.ctypes.data)
+        else:
+            glBindBuffer(GL_PIXEL_PACK_BUFFER, pbo)
+            glReadPixels(0, 0, width, height, GL_RGB, GL_UNSIGNED_BYTE, 0)
+            glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+
+    def render_rgb(self):
+        """ Returns the RGB frame seen by the agent. The frame is drawn
+        offscreen and read back into a persistent array, which is returned
+        by every call and overwritten by the next one: copy it if it has to
+        be kept. As with `.render`, nothing is drawn if the view is unchanged.
+
+        If frames were requested with `.request_rgb`, the oldest of them is
+        returned instead.
+
+        """
+        if self._pending:
+            pbo, view = self._pending.popleft()
+            if pbo is not None:
+                self.switch_to()
+                glBindBuffer(GL_PIXEL_PACK_BUFFER, self._pbos[pbo])
+                data = glMapBufferRange(GL_PIXEL_PACK_BUFFER, 0, self._rgb.nbytes, GL_MAP_READ_BIT)
+                ctypes.memmove(self._rgb.ctypes.data, data, self._rgb.nbytes)
+                glUnmapBuffer(GL_PIXEL_PACK_BUFFER)
+                glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+            self._rgb_view = view
+            return self._rgb
+        view = self._view()
+        if self.overlay or view != self._rgb_view:
+            self._read_offscreen()
+            self._rgb_view = view
+        return self._rgb
+
+    def request_rgb(self):
+        """ Draws the current frame and starts reading it back into one of the
+        `pixel_buffers` pixel buffer objects without waiting for the transfer.
+        The frame is returned by a later call of `.render_rgb`, so the readback
+        of a frame can overlap the simulation of the next one::
+
+            renderer.request_rgb()
+            ... # update the world and the agent
+            frame = renderer.render_rgb() # the requested frame
+
+        Up to `pixel_buffers` frames can be pending; they are returned in order.
+
+        """
+        if not self.pixel_buffers:
+            raise ValueError('Create the renderer with pixel_buffers > 0 to request frames')
+        if len(self._pending) == self.pixel_buffers:
+            raise RuntimeError(f'{self.pixel_buffers} frames are pending, call .render_rgb first')
+        view = self._view()
+        previous = self._pending[-1][1] if self._pending else self._rgb_view
+        if not self.overlay and view == previous:
+            self._pending.append((None, view))
+            return
+        self.switch_to()
+        if self._offscreen_resized():
+            if self._pending:
+                # the pending frames are read back at the size they were drawn at
+                raise RuntimeError('The window was resized while frames are pending, call .render_rgb first')
+            self._setup_offscreen()
+        pbo = self._next_pbo
+        self._next_pbo = (pbo + 1) % self.pixel_buffers
+        self._read_offscreen(self._pbos[pbo])
+        self._pending.append((pbo, view))
+
+
+    def add_ground(self):
+        """ Adds the ground to the batch as a single vertex list made of
+        the top faces of all ground blocks.
+
+        """
+        n = GROUND_SIZE
+        vertex_data = []
+        texture_data = []
+        for x in range(-n, n + 1):
+            for z in range(-n, n + 1):
+                vertex_data.extend(cube_vertices(x, GROUND_LEVEL, z, 0.5, top_only=True))
+                texture_data.extend(id2top_texture[self.model.ground(x, GROUND_LEVEL, z)])
+        return self.batch.add(len(vertex_data) // 3, GL_QUADS, self.texture_group,
             ('v3f/static', vertex_data),
             ('t2f/static', texture_data),
         )
 
+    def add_block(self, position, texture_id, **kwargs):
+        position = tuple(position)
+        self._shown[position] = texture_id
+        self._chunk_blocks.setdefault(sectorize(position), {})[position] = None
+        self._touch(position)
+
     def remove_block(self, position, **kwargs):
+        position = tuple(position)
         if position in self._shown:
-            self._shown.pop(position).delete()
+            del self._shown[position]
+            del self._chunk_blocks[sectorize(position)][position]
+            self._touch(position)
+
+    def add_blocks(self, positions, texture_ids, **kwargs):
+        for position, texture_id in zip(map(tuple, positions.tolist()), texture_ids.tolist()):
+            self.add_block(position, texture_id)
+
+    def remove_blocks(self, positions, **kwargs):
+        for position in map(tuple, positions.tolist()):
+            self.remove_block(position)
+
+    def _touch(self, position):
+        """ Marks the chunks whose meshes depend on the block at `position`,
+        i.e. its own chunk and the chunks of its horizontal neighbors.
+
+        """
+        x, y, z = position
+        for dx, dz in ((0, 0), (-1, 0), (1, 0), (0, -1), (0, 1)):
+            self._stale_chunks.add(sectorize((x + dx, y, z + dz)))
+        self._revision += 1
+
+    def update_chunks(self):
+        """ Rebuilds the vertex lists of the chunks where blocks were
+        added or removed since the last call.
+
+        """
+        for chunk in self._stale_chunks:
+            self.build_chunk(chunk)
+        self._stale_chunks.clear()
+
+    def build_chunk(self, chunk):
+        """ Replaces the vertex list of the chunk with one made of the faces
+        of its blocks that are not hidden by an adjacent block.
+
+        Merging faces (greedy meshing) isn't possible here: block textures
+        are tiles of a single atlas, so a merged face can't repeat them.
+
+        """
+        if chunk in self._chunks:
+            self._chunks.pop(chunk).delete()
+        positions = self._chunk_blocks.get(chunk)
+        if not positions:
+            self._chunk_blocks.pop(chunk, None)
+            return
+        positions = list(positions)
+        faces, hidden = self._face_masks(positions)
+        vertex_list = self._add_faces(positions, faces & ~hidden)
+        if vertex_list is not None:
+            self._chunks[chunk] = vertex_list
+
+    def update_near_faces(self):
+        """ Rebuilds the vertex list of the hidden faces of the blocks
+        around the camera if the camera moved to another block or the world
+        changed since the last call.
+
+        The chunk meshes skip the faces between adjacent blocks, but from
+        inside a block (or within the near plane distance of one) these
+        faces are the first surfaces in view, so they are drawn for the
+        blocks next to the camera.
+
+        """
+        key = normalize(self.agent.position), self._revision
+        if key == self._near_key:
+            return
+        self._near_key = key
+        if self._near_faces is not None:
+            self._near_faces.delete()
+            self._near_faces = None
+        camera = np.array(key[0])
+        positions = [
+            position for position in itertools.product(*(range(c - 2, c + 3) for c in key[0]))
+            if position in self._shown
+        ]
+        if not positions:
+            return
+        faces, hidden = self._face_masks(positions)
+        positions = np.array(positions)
+        # faces of the blocks around the camera and the faces of their neighbors facing them
+        near = np.abs(positions - camera).max(axis=1) <= 1
+        near_neighbors = np.abs(positions[:, None] + np.array(FACES) - camera).max(axis=2) <= 1
+        self._near_faces = self._add_faces(positions, faces & hidden & (near[:, None] | near_neighbors))
+
+    def _face_masks(self, positions):
+        """ Returns which faces the blocks at `positions` have (flat blocks
+        only have a top face) and which faces are hidden by an adjacent block,
+        as arrays of shape (len(positions), len(FACES)).
+
+        """
+        flat = [self._shown[tuple(position)] in FLAT_BLOCKS for position in positions]
+        hidden = np.array([
+            [self._shown.get((x + dx, y + dy, z + dz), WHITE) not in FLAT_BLOCKS for dx, dy, dz in FACES]
+            for x, y, z in positions
+        ], dtype=bool).reshape(len(positions), len(FACES))
+        faces = np.ones_like(hidden)
+        faces[flat, 1:] = False
+        return faces, hidden
+
+    def _add_faces(self, positions, mask):
+        """ Adds the faces of the blocks at `positions` selected by `mask`
+        to the batch as a single vertex list. Returns None if there are none.
+
+        """
+        vertices = np.tile(np.array(positions, dtype=np.float64), 4)[:, None] + FACE_VERTICES
+        textures = np.stack([FACE_TEXTURES[self._shown[tuple(position)]] for position in positions])
+        vertex_data = vertices[mask].ravel().tolist()
+        texture_data = textures[mask].ravel().tolist()
+        if not vertex_data:
+            return None
+        return self.batch.add(len(vertex_data) // 3, GL_QUADS, self.texture_group,
+            ('v3f/static', vertex_data),
+            ('t2f/static', texture_data),
+        )
 
     def draw_focused_block(self):
         """ Draw black edges around the block that is currently under the
@@ -193,7 +545,7 @@ class Renderer(Window):
         x, y, z = self.agent.position
         i = self.agent.inventory
         self.label.text = f'{int(pyglet.clock.get_fps()):02d} ({x:.2f}, {y:.2f}, {z:.2f}) ' \
-            f'{len(self._shown)} / {len(self.model.world)} ' \
+            f'{len(self._shown)} / {len(self.model)} ' \
             f'({i[0]}, {i[1]}, {i[2]}, {i[3]}, {i[4]}, {i[5]})'
         self.label.draw()
 
@@ -1,2 +1,4 @@
 from .task_set import CustomTasks, RandomTasks, DUMMY_TASK
-from .task import Task, Tasks
\ No newline at end of file
+from .task import Task, Tasks, score_batch
+from .packed import PackedGrid
+from .blocks import BlockList
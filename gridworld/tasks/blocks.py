@@ -0,0 +1,146 @@
+from itertools import chain
+
+import numpy as np
+
+from ..utils import BUILD_ZONE_SIZE_X, BUILD_ZONE_SIZE_Z, BUILD_ZONE_SIZE
+
+BLOCK_DTYPE = np.dtype([('x', np.int64), ('y', np.int64), ('z', np.int64), ('id', np.int64)])
+
+
+class BlockList:
+    """
+    Sparse list of (x, y, z, block_id) blocks backed by a read-only structured
+    numpy array with fields `x`, `y`, `z` and `id`.
+
+    It can be used in place of a list of tuples: iterating, indexing and
+    comparing with lists yield tuples of python ints. Conversions to and from
+    dense (9, 11, 11) build zone grids and set operations are vectorized.
+    """
+    __slots__ = 'array',
+
+    def __init__(self, blocks=()):
+        """
+        Args:
+            blocks: BlockList, array of BLOCK_DTYPE, or a sequence or an (N, 4)
+                array of (x, y, z, block_id)
+        """
+        if isinstance(blocks, BlockList):
+            array = blocks.array
+        elif isinstance(blocks, np.ndarray) and blocks.dtype == BLOCK_DTYPE:
+            array = blocks.copy()
+        elif isinstance(blocks, (list, tuple)):
+            # much faster than np.array for sequences of tuples
+            array = np.fromiter(chain.from_iterable(blocks), dtype=np.int64, count=4 * len(blocks))
+            array = array.view(BLOCK_DTYPE)
+        else:
+            array = np.array(blocks, dtype=np.int64).reshape(-1, 4).view(BLOCK_DTYPE).reshape(-1)
+        array.setflags(write=False)
+        self.array = array
+
+    @classmethod
+    def from_dense(cls, grid):
+        """
+        Returns blocks of a dense grid of shape (9, 11, 11) in (y, x, z) order.
+        """
+        y, x, z = grid.nonzero()
+        array = np.empty(len(y), dtype=BLOCK_DTYPE)
+        array['x'] = x - BUILD_ZONE_SIZE_X // 2
+        array['y'] = y - 1
+        array['z'] = z - BUILD_ZONE_SIZE_Z // 2
+        array['id'] = grid[y, x, z]
+        return cls(array)
+
+    def to_dense(self, dtype=np.int64):
+        """
+        Returns a dense grid of shape (9, 11, 11). Later blocks overwrite
+        earlier ones at the same position.
+        """
+        grid = np.zeros(BUILD_ZONE_SIZE, dtype=dtype)
+        a = self.array
+        grid[a['y'] + 1, a['x'] + BUILD_ZONE_SIZE_X // 2, a['z'] + BUILD_ZONE_SIZE_Z // 2] = a['id']
+        return grid
+
+    @property
+    def positions(self):
+        """
+        (N, 3) array of block positions.
+        """
+        return self.rows[:, :3]
+
+    @property
+    def ids(self):
+        return self.array['id']
+
+    @property
+    def rows(self):
+        """
+        (N, 4) read-only view of the blocks.
+        """
+        return self.array.view(np.int64).reshape(-1, 4)
+
+    def _isin(self, other, columns):
+        """
+        Returns whether each block of this list matches a block of the other
+        list on the given columns.
+        """
+        if len(self) == 0 or len(other) == 0:
+            return np.zeros(len(self), dtype=bool)
+        rows = np.concatenate([self.rows[:, columns], other.rows[:, columns]])
+        _, keys = np.unique(rows, axis=0, return_inverse=True)
+        keys = keys.reshape(-1)
+        return np.isin(keys[:len(self)], keys[len(self):])
+
+    def difference(self, other):
+        """
+        Returns blocks of this list that are not in the other one
+        (with the same position and id).
+        """
+        other = BlockList(other)
+        return BlockList(self.array[~self._isin(other, slice(None))])
+
+    def union(self, other):
+        """
+        Returns blocks of both lists. Blocks of the other list replace
+        blocks of this one at the same positions.
+        """
+        other = BlockList(other)
+        kept = self.array[~self._isin(other, slice(0, 3))]
+        return BlockList(np.concatenate([kept, other.array]))
+
+    __sub__ = difference
+    __or__ = union
+
+    def tolist(self):
+        return self.array.tolist()
+
+    def __array__(self, dtype=None, copy=None):
+        return self.rows.astype(np.int64 if dtype is None else dtype, copy=bool(copy))
+
+    def __len__(self):
+        return len(self.array)
+
+    def __iter__(self):
+        return iter(self.array.tolist())
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return self.array[index].item()
+        return BlockList(self.array[index])
+
+    def __eq__(self, other):
+        if isinstance(other, BlockList):
+            return np.array_equal(self.rows, other.rows)
+        if isinstance(other, (list, tuple)):
+            return self.tolist() == [tuple(block) for block in other]
+        return NotImplemented
+
+    __hash__ = None
+
+    def __getstate__(self):
+        return self.rows.copy(),
+
+    def __setstate__(self, state):
+        self.__init__(state[0])
+
+    def __repr__(self) -> str:
+        return f'BlockList({self.tolist()})'
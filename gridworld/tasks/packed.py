@@ -0,0 +1,144 @@
+import numpy as np
+
+from .blocks import BlockList
+from ..utils import BUILD_ZONE_SIZE_X, BUILD_ZONE_SIZE_Z, BUILD_ZONE_SIZE
+
+# block ids of the colors that can be placed in the build zone
+COLORS = np.arange(1, 7)
+_CELLS = int(np.prod(BUILD_ZONE_SIZE))
+# each bitset is padded to a whole number of 64-bit words
+WORDS = (_CELLS + 63) // 64
+_WORD = np.dtype('<u8')
+
+if hasattr(np, 'bitwise_count'):
+    def _bit_counts(words):
+        return np.bitwise_count(words)
+else:
+    _BYTE_COUNTS = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+    def _bit_counts(words):
+        words = np.ascontiguousarray(words, dtype=_WORD)
+        return _BYTE_COUNTS[words.view(np.uint8)]
+
+
+def popcount(words):
+    """
+    Returns the number of set bits in the last axis of an array of 64-bit words.
+    """
+    counts = _bit_counts(words)
+    return counts.reshape(*counts.shape[:-1], -1).sum(axis=-1, dtype=np.int64)
+
+
+class PackedGrid:
+    """
+    Bit-packed build zone grid: one bitset of 9 * 11 * 11 bits per block color,
+    stored as an array of shape (6, WORDS) of 64-bit words. Cells are ordered
+    as in a flattened dense grid of shape (9, 11, 11), i.e. by (y, x, z).
+
+    A packed grid takes 864 bytes instead of 4356 for an int32 grid,
+    hashes by content and counts blocks and intersections with popcount.
+    Batches of grids are packed into arrays of shape (B, 6, WORDS), see `.pack`.
+
+    Only grids of placed blocks can be packed: there is no bitset for
+    negative ids, so diff grids such as the synthetic targets of the
+    environment (where a negative id means that the block is removed)
+    have to stay dense.
+    """
+    __slots__ = 'bits',
+
+    def __init__(self, bits):
+        bits = np.asarray(bits)
+        if bits.shape != (len(COLORS), WORDS):
+            raise ValueError(f'Expected bitsets of shape {(len(COLORS), WORDS)}, got {bits.shape}')
+        self.bits = bits.astype(_WORD, copy=False)
+
+    @staticmethod
+    def pack(grids):
+        """
+        Packs dense grids of shape (..., 9, 11, 11) into bitsets of shape (..., 6, WORDS).
+        Raises ValueError if a grid holds ids other than 0 and the block colors.
+        """
+        grids = np.asarray(grids)
+        if grids.shape[-3:] != BUILD_ZONE_SIZE:
+            raise ValueError(f'Expected grids of shape (..., {", ".join(map(str, BUILD_ZONE_SIZE))}), got {grids.shape}')
+        flat = grids.reshape(*grids.shape[:-3], 1, _CELLS)
+        if ((flat < 0) | (flat > COLORS[-1])).any():
+            raise ValueError(f'Block ids must be between 0 and {COLORS[-1]}')
+        masks = np.zeros((*grids.shape[:-3], len(COLORS), WORDS * 64), dtype=bool)
+        np.equal(flat, COLORS[:, None], out=masks[..., :_CELLS])
+        return np.packbits(masks, axis=-1, bitorder='little').view(_WORD)
+
+    @staticmethod
+    def unpack(bits, dtype=np.int64):
+        """
+        Unpacks bitsets of shape (..., 6, WORDS) into dense grids of shape (..., 9, 11, 11).
+        """
+        bits = np.ascontiguousarray(bits, dtype=_WORD)
+        masks = np.unpackbits(bits.view(np.uint8), axis=-1, count=_CELLS, bitorder='little')
+        grids = np.zeros((*bits.shape[:-2], _CELLS), dtype=dtype)
+        for i, color in enumerate(COLORS):
+            grids[masks[..., i, :].astype(bool)] = color
+        return grids.reshape(*bits.shape[:-2], *BUILD_ZONE_SIZE)
+
+    @classmethod
+    def from_dense(cls, grid):
+        return cls(cls.pack(grid))
+
+    @classmethod
+    def from_sparse(cls, blocks):
+        """
+        Packs a `BlockList` or a list of (x, y, z, block_id) tuples in the build zone coordinates.
+        Raises ValueError if a block id isn't a block color or a block is outside of the build zone.
+        """
+        bits = np.zeros((len(COLORS), WORDS * 64), dtype=bool)
+        x, y, z, ids = np.asarray(blocks, dtype=np.int64).reshape(-1, 4).T
+        if ((ids < COLORS[0]) | (ids > COLORS[-1])).any():
+            raise ValueError(f'Block ids must be between {COLORS[0]} and {COLORS[-1]}')
+        inside = (np.abs(x) <= BUILD_ZONE_SIZE_X // 2) & (np.abs(z) <= BUILD_ZONE_SIZE_Z // 2) \
+            & (y >= -1) & (y < BUILD_ZONE_SIZE[0] - 1)
+        if not inside.all():
+            raise ValueError(f'Block position {tuple(np.stack([x, y, z])[:, np.argmin(inside)].tolist())} '
+                             'is outside of the build zone')
+        cells = ((y + 1) * BUILD_ZONE_SIZE_X + x + BUILD_ZONE_SIZE_X // 2) * BUILD_ZONE_SIZE_Z \
+            + z + BUILD_ZONE_SIZE_Z // 2
+        bits[ids - COLORS[0], cells] = True
+        return cls(np.packbits(bits, axis=-1, bitorder='little').view(_WORD))
+
+    def to_dense(self, dtype=np.int64):
+        return self.unpack(self.bits, dtype=dtype)
+
+    def to_sparse(self):
+        """
+        Returns a `BlockList` of the grid in the build zone coordinates.
+        """
+        return BlockList.from_dense(self.to_dense())
+
+    def count(self):
+        """
+        Returns the number of blocks in the grid.
+        """
+        return popcount(self.bits).sum().item()
+
+    def intersection(self, other):
+        """
+        Returns the number of cells holding blocks of the same color in both grids.
+        """
+        return popcount(self.bits & other.bits).sum().item()
+
+    def __len__(self):
+        return self.count()
+
+    def __eq__(self, other):
+        return isinstance(other, PackedGrid) and np.array_equal(self.bits, other.bits)
+
+    def __hash__(self):
+        return hash(self.bits.tobytes())
+
+    def __getstate__(self):
+        return self.bits,
+
+    def __setstate__(self, state):
+        self.bits, = state
+
+    def __repr__(self) -> str:
+        return f'PackedGrid(blocks={self.count()})'
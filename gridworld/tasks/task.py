@@ -1,11 +1,186 @@
+import copy
+import hashlib
+from functools import lru_cache
+
 import numpy as np
 
-BUILD_ZONE_SIZE_X = 11
-BUILD_ZONE_SIZE_Z = 11
-BUILD_ZONE_SIZE = 9, 11, 11
+from .blocks import BlockList
+from .packed import PackedGrid
+from ..utils import BUILD_ZONE_SIZE_X, BUILD_ZONE_SIZE_Z, BUILD_ZONE_SIZE
+
+# grids are padded by this many cells along x and z, so that any shift stays within the array
+_PAD = BUILD_ZONE_SIZE_X - 1
+_PADDED_X = BUILD_ZONE_SIZE_X + 2 * _PAD
+_PADDED_Z = BUILD_ZONE_SIZE_Z + 2 * _PAD
+# max number of distinct grids for which rotations, admissible shifts and
+# intersection indices are kept in the process-wide caches below
+GRID_CACHE_SIZE = 4096
+# max number of gathered voxels held in memory at once by batched scoring
+_SCORE_CHUNK = 1 << 22
+
+
+class _GridKey:
+    """
+    Cache key that hashes a grid by its content, so that tasks with equal
+    grids share cache entries. Keeps a read-only copy of the grid it was made
+    from, so that later changes to that grid don't leak into the caches.
+    """
+    __slots__ = 'grid', 'digest'
+
+    def __init__(self, grid):
+        self.grid = _read_only(np.array(grid))
+        data = np.ascontiguousarray(self.grid, dtype=np.int64)
+        self.digest = grid.shape, hashlib.blake2b(data.tobytes(), digest_size=16).digest()
+
+    def __hash__(self):
+        return hash(self.digest)
+
+    def __eq__(self, other):
+        return isinstance(other, _GridKey) and self.digest == other.digest
+
+
+def _read_only(array):
+    array.setflags(write=False)
+    return array
+
+
+@lru_cache(maxsize=GRID_CACHE_SIZE)
+def _rotations(key):
+    """
+    Returns three rotations of the grid around the vertical axis
+    (by 90, 180 and 270 degrees). The arrays are shared and read-only.
+    """
+    return tuple(
+        _read_only(np.rot90(key.grid, -k, axes=(1, 2)).astype(np.int32)) for k in range(1, 4)
+    )
+
+
+@lru_cache(maxsize=GRID_CACHE_SIZE)
+def _admissible_shifts(key, invariant):
+    """
+    Returns admissible (dx, dz) shifts for each of the four rotations of the
+    structure. The result is shared, so it is made of tuples.
+    """
+    if not invariant:
+        return ((0, 0),),
+    # the structure fits iff its bounding box does
+    occupied = (key.grid != 0).any(axis=0)
+    admissible = []
+    for k in range(4):
+        mask = np.rot90(occupied, -k)
+        xs, = mask.any(axis=1).nonzero()
+        zs, = mask.any(axis=0).nonzero()
+        if len(xs) == 0:
+            x_range = z_range = range(-BUILD_ZONE_SIZE_X + 1, BUILD_ZONE_SIZE_X)
+        else:
+            x_range = range(xs[-1] - BUILD_ZONE_SIZE_X + 1, xs[0] + 1)
+            z_range = range(zs[-1] - BUILD_ZONE_SIZE_Z + 1, zs[0] + 1)
+        admissible.append(tuple((dx, dz) for dx in x_range for dz in z_range))
+    return tuple(admissible)
+
+
+def _build_shift_index(target_grids, admissible):
+    """
+    Builds the data needed to compute intersections for all admissible
+    (dx, dz, rotation) hypotheses at once. Rotations whose target grid and
+    admissible shifts coincide with an earlier rotation (e.g. of rotationally
+    symmetric structures) are not included; `aliases` maps each rotation to
+    the one that represents it.
+
+    Returns:
+        aliases (tuple): representative rotation of each rotation;
+        rotations (np.ndarray): rotation of each hypothesis;
+        shifts (np.ndarray): (dx, dz) of each hypothesis;
+        rows (np.ndarray): row of `flat` and `ids` of each hypothesis;
+        offsets (np.ndarray): flat index offsets of the shift of each hypothesis;
+        flat (np.ndarray): per representative rotation, flat indices of target blocks in a padded grid;
+        ids (np.ndarray): per representative rotation, ids of target blocks.
+    """
+    aliases, rotations, shifts, rows, flat, ids = [], [], [], [], [], []
+    for i, shifts_i in enumerate(admissible):
+        target = target_grids[i]
+        alias = next((j for j in range(i) if aliases[j] == j and admissible[j] == shifts_i
+                      and np.array_equal(target_grids[j], target)), i)
+        aliases.append(alias)
+        if alias != i:
+            continue
+        y, x, z = target.nonzero()
+        rows.extend([len(flat)] * len(shifts_i))
+        flat.append((y * _PADDED_X + x + _PAD) * _PADDED_Z + z + _PAD)
+        ids.append(target[y, x, z])
+        rotations.extend([i] * len(shifts_i))
+        shifts.extend(shifts_i)
+    shifts = np.array(shifts, dtype=np.int64).reshape(-1, 2)
+    arrays = (
+        np.array(rotations, dtype=np.int64), shifts, np.array(rows, dtype=np.int64),
+        shifts[:, 0] * _PADDED_Z + shifts[:, 1], np.stack(flat), np.stack(ids)
+    )
+    return (tuple(aliases), *map(_read_only, arrays))
+
+
+@lru_cache(maxsize=GRID_CACHE_SIZE)
+def _cached_shift_index(target_key, admissible_key):
+    target_grids = [target_key.grid, *_rotations(target_key)]
+    return _build_shift_index(target_grids, _admissible_shifts(*admissible_key))
+
+
+def _as_dense(grids):
+    """
+    Unpacks a `PackedGrid` or a sequence of them, other grids are returned as is.
+    """
+    if isinstance(grids, PackedGrid):
+        return grids.to_dense()
+    if isinstance(grids, (list, tuple)) and len(grids) and isinstance(grids[0], PackedGrid):
+        return PackedGrid.unpack(np.stack([grid.bits for grid in grids]))
+    return grids
+
+
+def _detection_scores(max_int, argmax, grid_size, target_size):
+    precision = np.divide(max_int, grid_size, out=np.zeros(len(max_int)), where=grid_size > 0)
+    recall = np.divide(max_int, target_size, out=np.zeros(len(max_int)), where=target_size > 0)
+    total = precision + recall
+    f1 = np.divide(2 * precision * recall, total, out=np.zeros(len(max_int)), where=total > 0)
+    return {'max_int': max_int, 'argmax': argmax, 'precision': precision, 'recall': recall, 'f1': f1}
+
+
+def score_batch(tasks, grids):
+    """
+    Scores B grids against B tasks, the i-th grid against the i-th task.
+    Tasks with the same target and admissible shifts are scored together.
+    See `Task.score_batch` for the returned values.
+    """
+    grids = np.asarray(_as_dense(grids))
+    if len(tasks) != len(grids):
+        raise ValueError(f'Got {len(tasks)} tasks for {len(grids)} grids')
+    groups = {}
+    for i, task in enumerate(tasks):
+        groups.setdefault(id(task._get_shift_index()), (task, []))[1].append(i)
+    result = None
+    for task, idx in groups.values():
+        scores = task.score_batch(grids[idx])
+        if result is None:
+            result = {k: np.zeros((len(grids), *v.shape[1:]), dtype=v.dtype) for k, v in scores.items()}
+        for k, v in scores.items():
+            result[k][idx] = v
+    if result is None:
+        empty = np.zeros(0, dtype=np.int64)
+        result = _detection_scores(empty, np.zeros((0, 3), dtype=np.int64), empty, empty)
+    return result
 
 
 class Task:
+    # hypotheses and gather indices of target blocks, built on the first intersection query
+    _shift_index = None
+    # cache keys of the target grid and of the admissible shifts (None if they were set explicitly)
+    _target_key = None
+    _admissible_key = None
+    # padded target grids for incremental intersection updates, built on first use
+    _padded_targets = None
+    # running intersection of each hypothesis with the last grid passed to .step_intersection
+    _scores = None
+    # (starting grid, intersections with it) to make repeated resets cheap
+    _initial_scores = None, None
+
     def __init__(self, chat, target_grid, last_instruction=None, starting_grid=None, full_grid=None, invariant=True):
         """Creates a new Task represented with the past dialog and grid,
         the new instruction and target grid after completing the instruction.
@@ -31,45 +206,67 @@ class Task:
         self.starting_grid = starting_grid
         self.last_instruction = last_instruction
         self.full_grid = full_grid
-        self.admissible = [[] for _ in range(4)]
+        self.invariant = invariant
+        # computed on first access, see .admissible
+        self._admissible = None
         self.target_size = (target_grid != 0).sum().item()
         self.full_size = self.target_size
         if full_grid is not None:
             self.full_size = (full_grid != 0).sum().item()
         self.target_grid = target_grid
-        self.target_grids = [target_grid]
-        full_grids = [full_grid]
+        # fill self.target_grids with four rotations of the original grid around the vertical axis
+        self._target_key = _GridKey(target_grid)
+        self.target_grids = [target_grid, *_rotations(self._target_key)]
         self.max_int = 0
         self.prev_grid_size = 0
         self.right_placement = 0
         self.wrong_placement = 0
-        # fill self.target_grids with four rotations of the original grid around the vertical axis
-        for _ in range(3):
-            self.target_grids.append(np.zeros(target_grid.shape, dtype=np.int32))
-            full_grids.append(np.zeros(target_grid.shape, dtype=np.int32))
-            for x in range(BUILD_ZONE_SIZE_X):
-                for z in range(BUILD_ZONE_SIZE_Z):
-                    self.target_grids[-1][:, z, BUILD_ZONE_SIZE_X - x - 1] \
-                        = self.target_grids[-2][:, x, z]
-                    if full_grid is not None:
-                        full_grids[-1][:, z, BUILD_ZONE_SIZE_X - x - 1] \
-                            = full_grids[-2][:, x, z]
-        # (dx, dz) is admissible iff the translation of target grid by (dx, dz) preserve (== doesn't cut)
-        # target structure within original (unshifted) target grid
-        if not invariant:
-            self.admissible = [[(0,0)]]
-        else:
-            for i in range(4):
-                if full_grid is not None:
-                    grid = full_grids[i]
-                else:
-                    grid = self.target_grids[i]
-                for dx in range(-BUILD_ZONE_SIZE_X + 1, BUILD_ZONE_SIZE_X):
-                    for dz in range(-BUILD_ZONE_SIZE_Z + 1, BUILD_ZONE_SIZE_Z):
-                        sls_target = grid[:, max(dx, 0):BUILD_ZONE_SIZE_X + min(dx, 0),
-                                            max(dz, 0):BUILD_ZONE_SIZE_Z + min(dz, 0):]
-                        if (sls_target != 0).sum().item() == self.full_size:
-                            self.admissible[i].append((dx, dz))
+
+    def __getstate__(self):
+        # rotations, admissible shifts and intersection indices are restored from the caches
+        state = self.__dict__.copy()
+        for name in ['target_grids', '_target_key', '_shift_index', '_padded_targets', '_initial_scores']:
+            state.pop(name, None)
+        if state.pop('_admissible_key', None) is not None:
+            state['_admissible'] = None
+        return state
+
+    def __copy__(self):
+        # unlike pickling, copies share the target grids and caches of the task
+        task = type(self).__new__(type(self))
+        task.__dict__.update(self.__dict__)
+        return task
+
+    def __setstate__(self, state):
+        # tasks pickled before admissible shifts became lazy
+        if 'admissible' in state:
+            state['_admissible'] = state.pop('admissible')
+        state.setdefault('invariant', True)
+        state.pop('target_grids', None)
+        self.__dict__.update(state)
+        self._target_key = _GridKey(self.target_grid)
+        self.target_grids = [self.target_grid, *_rotations(self._target_key)]
+
+    @property
+    def admissible(self):
+        """
+        Admissible (dx, dz) shifts for each of the four rotations of the target.
+        (dx, dz) is admissible iff the translation of target grid by (dx, dz) preserve (== doesn't cut)
+        target structure within original (unshifted) target grid.
+        """
+        if self._admissible is None:
+            grid = self.full_grid if self.full_grid is not None else self.target_grid
+            self._admissible_key = (_GridKey(grid), self.invariant)
+            self._admissible = _admissible_shifts(*self._admissible_key)
+        return self._admissible
+
+    @admissible.setter
+    def admissible(self, value):
+        self._admissible = value
+        self._admissible_key = None
+        self._shift_index = None
+        self._padded_targets = None
+        self._initial_scores = None, None
 
     def reset(self):
         """
@@ -77,8 +274,18 @@ class Task:
         Resets all fields at initialization of the new episode.
         """
         if self.starting_grid is not None:
-            self.max_int = self.maximal_intersection(Tasks.to_dense(self.starting_grid))
+            starting_grid, scores = self._initial_scores
+            if starting_grid is not self.starting_grid:
+                scores = self._hypothesis_scores(Tasks.to_dense(self.starting_grid))
+                self._initial_scores = self.starting_grid, scores
+            self._scores = scores
+            self.max_int = self._max_score()
+        elif self._shift_index is not None:
+            self._scores = np.zeros(len(self._shift_index[1]), dtype=np.int64)
+            self.max_int = 0
         else:
+            # built from the grid on the first step
+            self._scores = None
             self.max_int = 0
         self.prev_grid_size = len(self.starting_grid) if self.starting_grid is not None else 0
         self.right_placement = 0
@@ -100,16 +307,31 @@ class Task:
             else self.last_instruction[:20] + '...'
         return f"Task(instruction={instruction})"
 
-    def step_intersection(self, grid):
+    def step_intersection(self, grid, changed=None):
         """
         Calculates the difference between the maximal intersection at previous step and the current one.
         Note that the method updates object fields to save the grid size.
 
-        Args (grid): current grid
+        Args (grid): current grid, dense or `PackedGrid`
+        Args (changed): optional list of ((y, x, z), old, new) grid indices and block ids of
+            voxels changed since the previous call (empty if nothing changed). Given it,
+            the intersections of all hypotheses are updated incrementally instead of
+            being recomputed.
         """
-        grid_size = (grid != 0).sum().item()
+        if changed is not None and self._scores is not None:
+            grid_size = self.prev_grid_size
+            for index, old, new in changed:
+                grid_size += int(new != 0) - int(old != 0)
+                self._update_scores(index, old, new)
+        else:
+            grid_size = grid.count() if isinstance(grid, PackedGrid) else (grid != 0).sum().item()
+            if grid_size != self.prev_grid_size or changed is not None:
+                self._scores = self._hypothesis_scores(grid)
+            else:
+                # the grid is assumed to be unchanged, but it isn't known
+                self._scores = None
         wrong_placement = (self.prev_grid_size - grid_size)
-        max_int = self.maximal_intersection(grid) if wrong_placement != 0 else self.max_int
+        max_int = self._max_score() if wrong_placement != 0 else self.max_int
         done = max_int == self.target_size
         self.prev_grid_size = grid_size
         right_placement = (max_int - self.max_int)
@@ -119,23 +341,92 @@ class Task:
         return right_placement, wrong_placement, done
 
     def argmax_intersection(self, grid):
+        """
+        Returns the (dx, dz, rotation) hypothesis with the maximal intersection.
+        Ties are resolved in favor of the first hypothesis in `admissible` order;
+        (0, 0, 0) is returned if nothing intersects.
+        """
+        return self.score_intersections(grid)[1]
+
+    def _get_shift_index(self):
+        """
+        Returns the hypotheses and gather indices used to compute intersections,
+        see `_build_shift_index`. They are shared between tasks with the same
+        target and admissible shifts.
+        """
+        if self._shift_index is None:
+            admissible = self.admissible
+            if self._target_key is not None and self._admissible_key is not None:
+                self._shift_index = _cached_shift_index(self._target_key, self._admissible_key)
+            else:
+                self._shift_index = _build_shift_index(self.target_grids, admissible)
+        return self._shift_index
+
+    def _hypothesis_scores(self, grid):
+        """
+        Returns the intersections of the grid with all hypotheses of `_get_shift_index`.
+        """
+        # only the cells under target blocks are gathered, which is cheaper than
+        # intersecting bitsets of all hypotheses
+        grid = _as_dense(grid)
+        _, _, _, rows, offsets, flat, ids = self._get_shift_index()
+        padded = np.zeros((grid.shape[0], _PADDED_X, _PADDED_Z), dtype=grid.dtype)
+        padded[:, _PAD:_PAD + BUILD_ZONE_SIZE_X, _PAD:_PAD + BUILD_ZONE_SIZE_Z] = grid
+        padded = padded.ravel()
+        return (padded[flat[rows] - offsets[:, None]] == ids[rows]).sum(axis=1)
+
+    def _update_scores(self, index, old, new):
+        """
+        Updates the intersections of all hypotheses after the grid voxel at `index`
+        changes from `old` to `new`. Only the target voxel that each hypothesis
+        matches with this grid voxel is looked up.
+        """
+        aliases, _, _, rows, offsets, _, _ = self._get_shift_index()
+        if self._padded_targets is None:
+            targets = np.stack([self.target_grids[i] for i, alias in enumerate(aliases) if alias == i])
+            padded = np.zeros((len(targets), targets.shape[1], _PADDED_X, _PADDED_Z), dtype=targets.dtype)
+            padded[:, :, _PAD:_PAD + BUILD_ZONE_SIZE_X, _PAD:_PAD + BUILD_ZONE_SIZE_Z] = targets
+            # flat index of the target voxel matched with the grid voxel 0 by each hypothesis
+            self._padded_targets = padded.ravel(), rows * padded[0].size + offsets + _PAD * _PADDED_Z + _PAD
+        targets, lookup = self._padded_targets
+        y, x, z = index
+        matched = targets[lookup + (y * _PADDED_X + x) * _PADDED_Z + z]
+        # scores are never updated in place as environment snapshots may share them
+        if old != 0:
+            self._scores = self._scores - (matched == old)
+        if new != 0:
+            self._scores = self._scores + (matched == new)
+
+    def _max_score(self):
+        return self._scores.max().item() if len(self._scores) else 0
+
+    def score_intersections(self, grid):
+        """
+        Computes the intersection of the grid with all admissible rotations and
+        shifts of the target at once.
+
+        Returns:
+            max_int (int): maximal intersection;
+            argmax (tuple): (dx, dz, rotation) of the maximal intersection, see `argmax_intersection`;
+            scores (np.ndarray): score map of shape (4, 21, 21) indexed by
+                (rotation, dx + 10, dz + 10), -1 for non-admissible hypotheses.
+        """
+        aliases, rotations, shifts, _, _, _, _ = self._get_shift_index()
+        hypothesis_scores = self._hypothesis_scores(grid)
+        scores = np.full((4, 2 * _PAD + 1, 2 * _PAD + 1), -1, dtype=np.int64)
+        scores[rotations, shifts[:, 0] + _PAD, shifts[:, 1] + _PAD] = hypothesis_scores
+        for i, alias in enumerate(aliases):
+            scores[i] = scores[alias]
         max_int, argmax = 0, (0, 0, 0)
-        for i, admissible in enumerate(self.admissible):
-            for dx, dz in admissible:
-                x_sls = slice(max(dx, 0), BUILD_ZONE_SIZE_X + min(dx, 0))
-                z_sls = slice(max(dz, 0), BUILD_ZONE_SIZE_Z + min(dz, 0))
-                sls_target = self.target_grids[i][:, x_sls, z_sls]
-
-                x_sls = slice(max(-dx, 0), BUILD_ZONE_SIZE_X + min(-dx, 0))
-                z_sls = slice(max(-dz, 0), BUILD_ZONE_SIZE_Z + min(-dz, 0))
-                sls_grid = grid[:, x_sls, z_sls]
-                intersection = ((sls_target == sls_grid) & (sls_target != 0)).sum().item()
-                if intersection > max_int:
-                    max_int = intersection
-                    argmax =(dx, dz, i)
-        return argmax
+        if len(hypothesis_scores):
+            best = hypothesis_scores.argmax()
+            if hypothesis_scores[best] > 0:
+                max_int = hypothesis_scores[best].item()
+                argmax = (shifts[best, 0].item(), shifts[best, 1].item(), rotations[best].item())
+        return max_int, argmax, scores
 
     def get_intersection(self, grid, dx, dz, rot):
+        grid = _as_dense(grid)
         x_sls = slice(max(dx, 0), BUILD_ZONE_SIZE_X + min(dx, 0))
         z_sls = slice(max(dz, 0), BUILD_ZONE_SIZE_Z + min(dz, 0))
         sls_target = self.target_grids[rot][:, x_sls, z_sls]
@@ -145,20 +436,46 @@ class Task:
         return ((sls_target == sls_grid) & (sls_target != 0)).sum().item()
 
     def maximal_intersection(self, grid):
-        max_int = 0
-        for i, admissible in enumerate(self.admissible):
-            for dx, dz in admissible:
-                x_sls = slice(max(dx, 0), BUILD_ZONE_SIZE_X + min(dx, 0))
-                z_sls = slice(max(dz, 0), BUILD_ZONE_SIZE_Z + min(dz, 0))
-                sls_target = self.target_grids[i][:, x_sls, z_sls]
-
-                x_sls = slice(max(-dx, 0), BUILD_ZONE_SIZE_X + min(-dx, 0))
-                z_sls = slice(max(-dz, 0), BUILD_ZONE_SIZE_Z + min(-dz, 0))
-                sls_grid = grid[:, x_sls, z_sls]
-                intersection = ((sls_target == sls_grid) & (sls_target != 0)).sum().item()
-                if intersection > max_int:
-                    max_int = intersection
-        return max_int
+        scores = self._hypothesis_scores(grid)
+        return scores.max().item() if len(scores) else 0
+
+    def score_batch(self, grids):
+        """
+        Scores a batch of grids against the target, e.g. predictions of a model.
+
+        Args:
+            grids (np.ndarray): grids of shape (B, 9, 11, 11) or a list of `PackedGrid`.
+
+        Returns:
+            dict of arrays of length B:
+                max_int: maximal intersection of each grid with the target;
+                argmax: (dx, dz, rotation) of the maximal intersection, shape (B, 3),
+                    as in `argmax_intersection`; zeros if the grid doesn't intersect the target;
+                precision: max_int divided by the number of blocks in the grid;
+                recall: max_int divided by the number of blocks in the target;
+                f1: harmonic mean of precision and recall.
+            Precision, recall and f1 are zero where undefined.
+        """
+        grids = np.asarray(_as_dense(grids))
+        _, rotations, shifts, rows, offsets, flat, ids = self._get_shift_index()
+        gather = flat[rows] - offsets[:, None]
+        ids = ids[rows]
+        max_int = np.zeros(len(grids), dtype=np.int64)
+        argmax = np.zeros((len(grids), 3), dtype=np.int64)
+        chunk = max(1, _SCORE_CHUNK // max(gather.size, 1))
+        for start in range(0, len(grids) if len(rows) else 0, chunk):
+            batch = grids[start:start + chunk]
+            padded = np.zeros((len(batch), batch.shape[1], _PADDED_X, _PADDED_Z), dtype=batch.dtype)
+            padded[:, :, _PAD:_PAD + BUILD_ZONE_SIZE_X, _PAD:_PAD + BUILD_ZONE_SIZE_Z] = batch
+            scores = (padded.reshape(len(batch), -1)[:, gather] == ids).sum(axis=2)
+            best = scores.argmax(axis=1)
+            max_int[start:start + chunk] = scores[np.arange(len(batch)), best]
+            argmax[start:start + chunk, :2] = shifts[best]
+            argmax[start:start + chunk, 2] = rotations[best]
+        argmax[max_int == 0] = 0
+        grid_size = (grids != 0).sum(axis=(1, 2, 3))
+        return _detection_scores(max_int, argmax, grid_size, np.full(len(grids), self.target_size))
+
 
 class Tasks:
     """
@@ -166,24 +483,27 @@ class Tasks:
     """
     @classmethod
     def to_dense(cls, blocks):
-        if isinstance(blocks, (list, tuple)):
-            if all(isinstance(b, (list, tuple)) for b in blocks):
-                grid = np.zeros(BUILD_ZONE_SIZE, dtype=np.int)
-                for x, y, z, block_id in blocks:
-                    grid[y + 1, x + BUILD_ZONE_SIZE_X // 2, z + BUILD_ZONE_SIZE_Z // 2] = block_id
-                blocks = grid
+        """
+        Converts a sparse list of (x, y, z, block_id) blocks or a `PackedGrid`
+        into a dense grid of shape (9, 11, 11). Dense grids are returned as is.
+        """
+        if isinstance(blocks, PackedGrid):
+            return blocks.to_dense()
+        if isinstance(blocks, (list, tuple, BlockList)):
+            return BlockList(blocks).to_dense()
         return blocks
 
     @classmethod
     def to_sparse(cls, blocks):
-        if isinstance(blocks, np.ndarray):
-            idx = blocks.nonzero()
-            types = [blocks[i] for i in zip(*idx)]
-            blocks = [(*i, t) for *i, t in zip(*idx, types)]
-            new_blocks = []
-            for x, y, z, bid in blocks:
-                new_blocks.append((x - BUILD_ZONE_SIZE_X // 2, y - 1, z - BUILD_ZONE_SIZE_Z // 2, bid))
-            blocks = new_blocks
+        """
+        Converts a dense grid, a `PackedGrid` or a list of blocks into a `BlockList`.
+        """
+        if isinstance(blocks, PackedGrid):
+            return blocks.to_sparse()
+        if isinstance(blocks, np.ndarray) and blocks.ndim == 3:
+            return BlockList.from_dense(blocks)
+        if isinstance(blocks, (list, tuple)):
+            return BlockList(blocks)
         return blocks
 
     def reset(self) -> Task:
@@ -220,11 +540,21 @@ class Subtasks(Tasks):
         self.full_structure = self.to_dense(self.structure_seq[-1])
         self.current = self.reset()
 
+    # created on demand: prepared tasks by (turn_start, turn_goal, full) and dialogs of each number of turns
+    _tasks = None
+    _dialog_prefixes = None
+
     def __getattr__(self, name):
         if name == 'current':
             return
         return getattr(self.current, name)
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_tasks', None)
+        state.pop('_dialog_prefixes', None)
+        return state
+
     def reset(self):
         """
         Randomly selects a random task within the task sequence.
@@ -260,15 +590,26 @@ class Subtasks(Tasks):
     def create_task(self, turn_start: int, turn_goal: int):
         """
         Returns a task with context defined by `turn_start` and goal defined
-        by `turn_goal`
+        by `turn_goal`. Each call returns a new task; its target grids,
+        intersection indices and initial scores are computed once and shared
+        with the tasks returned for the same turns.
 
         """
-        dialog = ''
-        for turn in self.dialog[:turn_goal + 1]:
-            if isinstance(turn, list):
-                turn = '\n'.join(turn)
-            dialog += '\n' + turn if len(dialog) > 0 else turn
-        # dialog = '\n'.join([utt for utt in self.dialog[:turn_goal] if utt is not None])
+        if self._tasks is None:
+            self._tasks = {}
+        key = turn_start, turn_goal, self.full
+        task = self._tasks.get(key)
+        if task is not None:
+            return copy.copy(task).reset()
+        if self._dialog_prefixes is None:
+            # the dialog of the first k turns for each k
+            self._dialog_prefixes = ['']
+            for turn in self.dialog:
+                if isinstance(turn, list):
+                    turn = '\n'.join(turn)
+                dialog = self._dialog_prefixes[-1]
+                self._dialog_prefixes.append(dialog + '\n' + turn if len(dialog) > 0 else turn)
+        dialog = self._dialog_prefixes[len(self.dialog[:turn_goal + 1])]
         if turn_start == -1:
             initial_blocks = []
         else:
@@ -283,13 +624,14 @@ class Subtasks(Tasks):
         )
         # To properly init max_int and prev_grid_size fields
         task.reset()
-        return task
+        self._tasks[key] = task
+        return copy.copy(task)
 
-    def step_intersection(self, grid):
+    def step_intersection(self, grid, changed=None):
         """
 
         """
-        right_placement, wrong_placement, done = self.current.step_intersection(grid)
+        right_placement, wrong_placement, done = self.current.step_intersection(grid, changed)
         if done and len(self.structure_seq) > self.task_goal and self.progressive:
             self.task_goal += 1
             self.current = self.create_task(self.task_start, self.task_goal)
@@ -41,6 +41,8 @@ class CustomTasks(Tasks):
         self.reset()
 
     def __getattr__(self, name):
+        if name == 'current':
+            return
         return getattr(self.current, name)
 
     def __len__(self):
@@ -88,6 +90,8 @@ class RandomTasks(Tasks):
         self.reset()
 
     def __getattr__(self, name):
+        if name == 'current':
+            return
         return getattr(self.current, name)
 
     def dump(self, path):
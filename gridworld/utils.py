@@ -23,6 +23,10 @@ TERMINAL_VELOCITY = 50
 
 PLAYER_HEIGHT = 2
 
+# The ground is a flat layer of blocks at this height
+GROUND_LEVEL = -2
+GROUND_SIZE = 18 # 1/2 width and height of the ground
+
 def cube_vertices(x, y, z, n, top_only=False):
     """ Return the vertices of the cube at position x, y, z with size 2*n.
 
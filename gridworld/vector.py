@@ -0,0 +1,520 @@
+import multiprocessing as mp
+import traceback
+from multiprocessing.connection import wait
+
+import numpy as np
+from gym.spaces import Box
+from gym.vector import VectorEnv
+
+from gridworld.env import create_env, step_many
+from gridworld.tasks.task import Task, Tasks
+
+
+def _copy_obs(obs):
+    return {key: value.copy() if isinstance(value, np.ndarray) else value for key, value in obs.items()}
+
+
+def _rollout(env, actions, obs_keys):
+    """
+    Runs a sequence of actions with `step_many`, resetting the environment
+    when an episode ends as the vector environments do.
+
+    Returns:
+        obs, rewards, dones, infos of each step and the current dialog
+    """
+    spaces = env.observation_space.spaces
+    keys = list(spaces) if obs_keys is None else obs_keys
+    obs = {
+        key: [] if key == 'dialog' else np.zeros((len(actions), *spaces[key].shape), dtype=spaces[key].dtype)
+        for key in keys
+    }
+    rewards = np.zeros(len(actions), dtype=np.float64)
+    dones = np.zeros(len(actions), dtype=bool)
+    infos = [{} for _ in actions]
+    dialog = None
+    t = 0
+    while t < len(actions):
+        chunk, chunk_rewards, chunk_dones, info = step_many(env, actions[t:], obs_keys=keys)
+        steps = len(chunk_dones)
+        rewards[t:t + steps] = chunk_rewards
+        dones[t:t + steps] = chunk_dones
+        for key, value in chunk.items():
+            if key == 'dialog':
+                obs[key].extend(value)
+            else:
+                obs[key][t:t + steps] = value
+        t += steps
+        last_obs = info.pop('last_observation')
+        dialog = last_obs.get('dialog')
+        if chunk_dones[-1]:
+            infos[t - 1] = dict(info, terminal_observation=_copy_obs(last_obs))
+            reset_obs = env.reset()
+            dialog = reset_obs.get('dialog')
+            for key in keys:
+                obs[key][t - 1] = reset_obs[key]
+    return obs, rewards, dones, infos, dialog
+
+
+def _select_keys(spaces, obs_keys):
+    """
+    Returns the given observation keys (all by default) in the order of the observation space.
+    """
+    if obs_keys is None:
+        return list(spaces)
+    unknown = set(obs_keys) - set(spaces)
+    if unknown:
+        raise ValueError(f'Unknown observation keys: {sorted(unknown)}, available: {list(spaces)}')
+    return [key for key in spaces if key in obs_keys]
+
+
+def _stack_rollouts(rollouts, keys):
+    """
+    Stacks rollouts of each environment into arrays of shape (T, N, ...)
+    and dialogs into lists of T lists.
+    """
+    obs = {}
+    for key in keys:
+        if key == 'dialog':
+            obs[key] = [list(dialogs) for dialogs in zip(*(rollout[0][key] for rollout in rollouts))]
+        else:
+            obs[key] = np.stack([rollout[0][key] for rollout in rollouts], axis=1)
+    rewards = np.stack([rollout[1] for rollout in rollouts], axis=1)
+    dones = np.stack([rollout[2] for rollout in rollouts], axis=1)
+    infos = [list(step_infos) for step_infos in zip(*(rollout[3] for rollout in rollouts))]
+    return obs, rewards, dones, infos
+
+
+class VectorGridWorld(VectorEnv):
+    """
+    Steps `num_envs` environments made by `create_env(**env_kwargs)` in one process.
+
+    Unlike `BatchedGridWorld`, it supports every `GridWorld` option, including
+    rendering. Environments write their observations right into the rows of
+    preallocated stacked arrays (e.g. ``grid[N, 9, 11, 11]`` or
+    ``pov[N, H, W, 3]``), the dialogs are returned as a list of strings.
+
+    Finished environments are reset automatically: the observation
+    returned for them belongs to the new episode and the last observation
+    of the finished one is stored in ``infos[i]['terminal_observation']``.
+
+    Args:
+        num_envs (int): number of environments
+        copy (bool): if False, `.reset` and `.step` return the stacked arrays
+            themselves, which are overwritten by the next call
+        env_kwargs: arguments of `create_env`
+    """
+    def __init__(self, num_envs, copy=True, **env_kwargs) -> None:
+        self.envs = [create_env(**env_kwargs) for _ in range(num_envs)]
+        self.copy = copy
+        env = self.envs[0]
+        super().__init__(num_envs, env.observation_space, env.action_space)
+        self.observations = {
+            key: np.zeros((num_envs, *space.shape), dtype=space.dtype)
+            for key, space in self.single_observation_space.spaces.items()
+            if isinstance(space, Box)
+        }
+        for i, env in enumerate(self.envs):
+            env.set_obs_buffers({key: buffer[i] for key, buffer in self.observations.items()})
+        self.dialogs = [''] * num_envs
+        self._rewards = np.zeros(num_envs, dtype=np.float64)
+        self._dones = np.zeros(num_envs, dtype=bool)
+
+    def set_task(self, task: Task):
+        """
+        Assigns provided task to all environments. See `GridWorld.set_task`.
+        """
+        for env in self.envs:
+            env.set_task(task)
+
+    def set_task_generator(self, task_generator: Tasks):
+        """
+        Sets task generator for all environments. See `GridWorld.set_task_generator`.
+        """
+        for env in self.envs:
+            env.set_task_generator(task_generator)
+
+    def _get_obs(self):
+        if self.copy:
+            obs = {key: buffer.copy() for key, buffer in self.observations.items()}
+        else:
+            obs = dict(self.observations)
+        if 'dialog' in self.single_observation_space.spaces:
+            obs['dialog'] = list(self.dialogs)
+        return obs
+
+    def reset(self, env_ids=None, **kwargs):
+        """
+        Resets environments with given ids (all by default) and returns
+        the batch of observations of all environments.
+        """
+        if env_ids is None:
+            env_ids = range(self.num_envs)
+        for i in env_ids:
+            self.dialogs[i] = self.envs[i].reset().get('dialog')
+        return self._get_obs()
+
+    def step_async(self, actions):
+        self._actions = actions
+
+    def step_wait(self, **kwargs):
+        infos = []
+        for i, (env, action) in enumerate(zip(self.envs, self._actions)):
+            obs, self._rewards[i], self._dones[i], info = env.step(action)
+            if self._dones[i]:
+                # the rows are overwritten by the reset
+                info = dict(info, terminal_observation=_copy_obs(obs))
+                self.dialogs[i] = env.reset().get('dialog')
+            infos.append(info)
+        return self._get_obs(), self._rewards.copy(), self._dones.copy(), infos
+
+    def step_many(self, actions, obs_keys=None):
+        """
+        Runs T steps of all environments, equivalent to calling `.step` with
+        each row of `actions` of shape (T, num_envs) but observations are
+        only stacked for `obs_keys` (all by default). The stacked arrays keep
+        the observation after the last step.
+
+        Returns:
+            obs (dict): observations of shape (T, num_envs, ...), dialogs as T lists;
+            rewards, dones (np.ndarray): arrays of shape (T, num_envs);
+            infos (list): T lists of infos of each environment.
+        """
+        keys = _select_keys(self.single_observation_space.spaces, obs_keys)
+        actions = np.asarray(actions)
+        rollouts = []
+        for i, env in enumerate(self.envs):
+            rollout = _rollout(env, actions[:, i], keys)
+            if rollout[4] is not None:
+                self.dialogs[i] = rollout[4]
+            rollouts.append(rollout)
+        return _stack_rollouts(rollouts, keys)
+
+
+def _shared_views(buffers):
+    return {key: np.frombuffer(raw, dtype=dtype).reshape(shape) for key, (raw, dtype, shape) in buffers.items()}
+
+
+def _worker(index, env_kwargs, buffers, num_buffers, pipe, parent_pipe):
+    """
+    Runs an environment made by `create_env(**env_kwargs)`. Observations are
+    written into the `index`-th row of the slot of the shared buffers given by
+    the parent, the rest of the results are sent back through the pipe.
+    """
+    parent_pipe.close()
+    # forked workers would otherwise share the random state of the parent
+    np.random.seed()
+    env = create_env(**env_kwargs)
+    views = _shared_views(buffers)
+    # the environment writes observations right into its rows of the shared buffers
+    slot_buffers = [{key: view[slot, index] for key, view in views.items()} for slot in range(num_buffers)]
+
+    while True:
+        try:
+            command, data = pipe.recv()
+        except (EOFError, KeyboardInterrupt):
+            # the parent is gone
+            break
+        except Exception:
+            pipe.send(('error', traceback.format_exc()))
+            continue
+        try:
+            if command == 'reset':
+                env.set_obs_buffers(slot_buffers[data])
+                result = env.reset().get('dialog')
+            elif command == 'step':
+                action, slot = data
+                env.set_obs_buffers(slot_buffers[slot])
+                obs, reward, done, info = env.step(action)
+                dialog = None
+                if done:
+                    info = dict(info, terminal_observation=_copy_obs(obs))
+                    dialog = env.reset().get('dialog')
+                result = reward, done, info, dialog
+            elif command == 'step_many':
+                actions, obs_keys, slot = data
+                env.set_obs_buffers(slot_buffers[slot])
+                result = _rollout(env, actions, obs_keys)
+            elif command == 'seed':
+                np.random.seed(data)
+                result = None
+            elif command == 'call':
+                name, args, kwargs = data
+                result = getattr(env, name)(*args, **kwargs)
+            elif command == 'close':
+                pipe.send(('ok', None))
+                break
+            else:
+                raise ValueError(f'Unknown command: {command}')
+        except Exception:
+            pipe.send(('error', traceback.format_exc()))
+        else:
+            pipe.send(('ok', result))
+
+
+class SubprocVectorGridWorld(VectorEnv):
+    """
+    Runs `num_envs` environments made by `create_env(**env_kwargs)` in
+    separate processes, so that each renderer gets its own GL context.
+
+    Workers write observations into shared memory and only actions, rewards,
+    dones and infos are sent through pipes. The observations returned by
+    `.reset` and `.step` are views of the shared buffers. The buffers form a
+    ring of `num_buffers` slots: returned arrays are overwritten by the
+    `num_buffers`-th next call of `.reset` or `.step`, so with the default of
+    two slots the previous observation stays valid while the next step runs.
+    Pass `copy=True` to get copies instead.
+
+    Finished environments are reset automatically, the last observation of
+    the finished episode is stored in ``infos[i]['terminal_observation']``.
+
+    Args:
+        num_envs (int): number of environments
+        num_buffers (int): number of slots of the observation buffers
+        copy (bool): whether to return copies of the shared buffers
+        context (str): multiprocessing start method, the platform default if None
+        env_kwargs: arguments of `create_env`
+    """
+    def __init__(self, num_envs, num_buffers=2, copy=False, context=None, **env_kwargs) -> None:
+        # spaces are taken from an environment that doesn't create a renderer
+        env = create_env(**dict(env_kwargs, fake=True))
+        super().__init__(num_envs, env.observation_space, env.action_space)
+        self.num_buffers = num_buffers
+        self.copy = copy
+        ctx = mp.get_context(context)
+        buffers = {}
+        for key, space in self.single_observation_space.spaces.items():
+            if isinstance(space, Box):
+                shape = (num_buffers, num_envs, *space.shape)
+                raw = ctx.RawArray('B', int(np.prod(shape)) * np.dtype(space.dtype).itemsize)
+                buffers[key] = raw, np.dtype(space.dtype), shape
+        self.buffers = _shared_views(buffers)
+        self.dialogs = [''] * num_envs
+        self._slot = 0
+        self.pipes, self.processes = [], []
+        for index in range(num_envs):
+            parent_pipe, child_pipe = ctx.Pipe()
+            process = ctx.Process(
+                target=_worker, name=f'GridWorldWorker-{index}', daemon=True,
+                args=(index, env_kwargs, buffers, num_buffers, child_pipe, parent_pipe)
+            )
+            process.start()
+            child_pipe.close()
+            self.pipes.append(parent_pipe)
+            self.processes.append(process)
+
+    def _recv(self, index):
+        status, result = self.pipes[index].recv()
+        if status == 'error':
+            raise RuntimeError(f'Environment {index} failed:\n{result}')
+        return result
+
+    def _call(self, env_ids, name, *args, **kwargs):
+        for i in env_ids:
+            self.pipes[i].send(('call', (name, args, kwargs)))
+        return [self._recv(i) for i in env_ids]
+
+    def set_task(self, task: Task):
+        """
+        Assigns provided task to all environments. See `GridWorld.set_task`.
+        """
+        self._call(range(self.num_envs), 'set_task', task)
+
+    def set_task_generator(self, task_generator: Tasks):
+        """
+        Sets task generator for all environments. See `GridWorld.set_task_generator`.
+        Each worker gets its own copy of the generator.
+        """
+        self._call(range(self.num_envs), 'set_task_generator', task_generator)
+
+    def seed(self, seeds=None):
+        """
+        Seeds the global numpy random state of each worker, which is used by task generators.
+        """
+        if seeds is None or isinstance(seeds, int):
+            seeds = [None if seeds is None else seeds + i for i in range(self.num_envs)]
+        for pipe, seed in zip(self.pipes, seeds):
+            pipe.send(('seed', seed))
+        for i in range(self.num_envs):
+            self._recv(i)
+
+    def _get_obs(self, slot):
+        obs = {key: buffer[slot] for key, buffer in self.buffers.items()}
+        if self.copy:
+            obs = {key: value.copy() for key, value in obs.items()}
+        if 'dialog' in self.single_observation_space.spaces:
+            obs['dialog'] = list(self.dialogs)
+        return obs
+
+    def _next_slot(self):
+        self._slot = (self._slot + 1) % self.num_buffers
+        return self._slot
+
+    def reset(self, env_ids=None, **kwargs):
+        """
+        Resets environments with given ids (all by default) and returns
+        the batch of observations of all environments.
+        """
+        if env_ids is None:
+            env_ids = range(self.num_envs)
+        previous, slot = self._slot, self._next_slot()
+        if len(env_ids) < self.num_envs:
+            # keep the observations of the other environments
+            for buffer in self.buffers.values():
+                buffer[slot] = buffer[previous]
+        for i in env_ids:
+            self.pipes[i].send(('reset', slot))
+        for i in env_ids:
+            self.dialogs[i] = self._recv(i)
+        return self._get_obs(slot)
+
+    def step_async(self, actions):
+        slot = self._next_slot()
+        for pipe, action in zip(self.pipes, actions):
+            pipe.send(('step', (action, slot)))
+
+    def step_wait(self, **kwargs):
+        rewards = np.zeros(self.num_envs, dtype=np.float64)
+        dones = np.zeros(self.num_envs, dtype=bool)
+        infos = []
+        for i in range(self.num_envs):
+            rewards[i], dones[i], info, dialog = self._recv(i)
+            if dialog is not None:
+                self.dialogs[i] = dialog
+            infos.append(info)
+        return self._get_obs(self._slot), rewards, dones, infos
+
+    def step_many(self, actions, obs_keys=None):
+        """
+        Runs T steps of all environments, equivalent to calling `.step` with
+        each row of `actions` of shape (T, num_envs), see `VectorGridWorld.step_many`.
+        Each worker runs its whole sequence at once and sends back
+        the stacked observations of `obs_keys`.
+        """
+        keys = _select_keys(self.single_observation_space.spaces, obs_keys)
+        actions = np.asarray(actions)
+        slot = self._next_slot()
+        for i, pipe in enumerate(self.pipes):
+            pipe.send(('step_many', (actions[:, i], keys, slot)))
+        rollouts = []
+        for i in range(self.num_envs):
+            rollout = self._recv(i)
+            if rollout[4] is not None:
+                self.dialogs[i] = rollout[4]
+            rollouts.append(rollout)
+        return _stack_rollouts(rollouts, keys)
+
+    def close_extras(self, **kwargs):
+        for pipe, process in zip(self.pipes, self.processes):
+            try:
+                pipe.send(('close', None))
+                pipe.recv()
+            except (BrokenPipeError, EOFError):
+                # the worker is already gone
+                pass
+            process.join()
+            pipe.close()
+
+
+class EnvPool(SubprocVectorGridWorld):
+    """
+    Asynchronous pool of worker environments: actions are sent to any subset
+    of environments with `.send` and `.recv` returns the results of the first
+    `batch_size` environments that are done, so that slow steps (large resets,
+    new subtasks, heavy renders) of some environments don't stall the others::
+
+        pool = EnvPool(num_envs=16, batch_size=8, render=True)
+        pool.set_task(task)
+        pool.async_reset()
+        while True:
+            obs, rewards, dones, infos, env_ids = pool.recv()
+            pool.send(policy(obs), env_ids)
+
+    Observations returned by `.recv` are copies gathered from the shared
+    buffers. The synchronous `.reset` and `.step` of `SubprocVectorGridWorld`
+    must not be called while steps are pending.
+
+    Args:
+        num_envs (int): number of environments
+        batch_size (int): number of environments returned by `.recv`, all by default
+        env_kwargs: arguments of `SubprocVectorGridWorld`
+    """
+    def __init__(self, num_envs, batch_size=None, **env_kwargs) -> None:
+        super().__init__(num_envs, **env_kwargs)
+        self.batch_size = num_envs if batch_size is None else batch_size
+        if not 0 < self.batch_size <= num_envs:
+            raise ValueError(f'batch_size must be between 1 and {num_envs}, got {batch_size}')
+        # 'reset' or 'step' for environments with a pending command
+        self._pending = {}
+
+    def _send(self, env_ids, command, data):
+        busy = [i for i in env_ids if i in self._pending]
+        if busy:
+            raise ValueError(f'Environments {busy} have pending steps, call .recv first')
+        for i, item in zip(env_ids, data):
+            self.pipes[i].send((command, item))
+            self._pending[i] = command
+
+    def async_reset(self, env_ids=None):
+        """
+        Resets environments with given ids (all by default). The initial
+        observations are returned by `.recv` with zero rewards.
+        """
+        if env_ids is None:
+            env_ids = range(self.num_envs)
+        self._send(env_ids, 'reset', [self._slot] * len(env_ids))
+
+    def send(self, actions, env_ids=None):
+        """
+        Starts steps of environments with given ids (all by default).
+        """
+        if env_ids is None:
+            env_ids = range(self.num_envs)
+        env_ids = [int(i) for i in env_ids]
+        if len(actions) != len(env_ids):
+            raise ValueError(f'Got {len(actions)} actions for {len(env_ids)} environments')
+        self._send(env_ids, 'step', [(action, self._slot) for action in actions])
+
+    def recv(self):
+        """
+        Waits for the first `batch_size` environments to finish their
+        pending commands and returns their results.
+
+        Returns:
+            obs, rewards, dones, infos, env_ids: batches of `batch_size` elements
+        """
+        if len(self._pending) < self.batch_size:
+            raise ValueError(f'{len(self._pending)} environments are pending, '
+                             f'at least {self.batch_size} are needed')
+        pipes = {self.pipes[i]: i for i in self._pending}
+        env_ids = []
+        while len(env_ids) < self.batch_size:
+            for pipe in wait(list(pipes)):
+                if len(env_ids) < self.batch_size:
+                    env_ids.append(pipes.pop(pipe))
+        rewards = np.zeros(self.batch_size, dtype=np.float64)
+        dones = np.zeros(self.batch_size, dtype=bool)
+        infos = []
+        for j, i in enumerate(env_ids):
+            result = self._recv(i)
+            if self._pending.pop(i) == 'reset':
+                self.dialogs[i] = result
+                infos.append({})
+                continue
+            rewards[j], dones[j], info, dialog = result
+            if dialog is not None:
+                self.dialogs[i] = dialog
+            infos.append(info)
+        obs = {key: buffer[self._slot, env_ids] for key, buffer in self.buffers.items()}
+        if 'dialog' in self.single_observation_space.spaces:
+            obs['dialog'] = [self.dialogs[i] for i in env_ids]
+        return obs, rewards, dones, infos, np.array(env_ids)
+
+    def close_extras(self, **kwargs):
+        # drain pending results so that workers can receive the close command
+        for i in list(self._pending):
+            try:
+                self.pipes[i].recv()
+            except EOFError:
+                pass
+        self._pending.clear()
+        super().close_extras(**kwargs)
@@ -39,16 +39,14 @@ class Visualizer:
             blocks: list of blocks to add/remove
             add: whether to add or remove blocks
         """
+        blocks = np.asarray(blocks, dtype=np.int64).reshape(-1, 4)
         if add:
-            for x,y,z, bid in blocks:
-                self.world.add_block((x, y, z), bid)
+            self.world.set_blocks(blocks[:, :3], blocks[:, 3])
         else:
-            for x,y,z, bid in blocks:
-                self.world.remove_block((x, y, z))
+            self.world.remove_blocks(blocks[:, :3])
     
     def clear(self):
-        for x,y,z in list(self.world.placed):
-            self.world.remove_block((x,y,z))
+        self.world.remove_blocks(list(self.world.placed))
 
     def render(self, position=None, rotation=None, blocks=None):
         """
@@ -64,11 +62,10 @@ class Visualizer:
         self.agent.position = position
         self.agent.rotation = rotation
         if blocks is not None:
-            for block in set(self.world.placed):
-                self.world.remove_block(block)
-            for x,y,z,bid in blocks:
-                self.world.add_block((x, y - 1, z), bid)
-        return self.renderer.render()[..., :-1]
+            self.clear()
+            blocks = np.asarray(blocks, dtype=np.int64).reshape(-1, 4)
+            self.world.set_blocks(blocks[:, :3] - (0, 1, 0), blocks[:, 3])
+        return self.renderer.render_rgb().copy()
 
     def render_video(self, output, 
             event_sequence, init_conds=None,
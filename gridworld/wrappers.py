@@ -7,6 +7,8 @@ from gym import Env, Wrapper
 import numpy as np
 from uuid import uuid4
 
+from gridworld.env import step_many, step_sequence
+
 
 class Actions(Wrapper):
     def __init__(self, env: Env) -> None:
@@ -31,6 +33,10 @@ class Actions(Wrapper):
         #     action += 6
         return self.env.step(self.action_map[action])
 
+    def step_many(self, actions, obs_keys=None, last_obs_keys=None):
+        actions = [self.action_map[action] for action in actions]
+        return step_many(self.env, actions, obs_keys=obs_keys, last_obs_keys=last_obs_keys)
+
 
 class debug(Wrapper):
     def __init__(self, env):
@@ -62,6 +68,9 @@ class debug(Wrapper):
         self.turn_goal = self.unwrapped.task.task_goal
         return obs
 
+    def step_many(self, actions, obs_keys=None, last_obs_keys=None):
+        return step_sequence(self, actions, obs_keys=obs_keys, last_obs_keys=last_obs_keys)
+
 
 class Logged(Wrapper):
     def __init__(self, env: Env) -> None:
@@ -129,6 +138,9 @@ class Logged(Wrapper):
                 self.data[k].append(obs[k])
         return obs
 
+    def step_many(self, actions, obs_keys=None, last_obs_keys=None):
+        return step_sequence(self, actions, obs_keys=obs_keys, last_obs_keys=last_obs_keys)
+
     def enable_renderer(self):
         self.env.enable_renderer()
         self.logging = True